@@ -0,0 +1,70 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+#Write speed and size of the output presets on representative frames, e.g.,
+#	python benchmarks/compression_presets.py --width 4000 --height 3000 --repeat 3
+#Frames are synthetic: smooth fields with sensor-like noise, as 8 bit NDVI, 16 bit NDVI, float32 reflectance and 8 bit RGB.
+import os, sys, io, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tifffile import TiffWriter
+from pmt import CalibrationIndiciesProcessor
+from synthetic import makeField
+
+def makeFrames(theHeight, theWidth):
+	reflectance = makeField(theHeight, theWidth, 3, 1)
+	ndvi = makeField(theHeight, theWidth, 1, 2)
+	frames = []
+	frames.append(('NDVI uint8', (ndvi * 255).astype('uint8')))
+	frames.append(('NDVI uint16', (ndvi * 65535).astype('uint16')))
+	frames.append(('reflectance float32', reflectance))
+	frames.append(('reflectance uint8', (reflectance * 255).astype('uint8')))
+	return frames
+
+def timeWrite(theProcessor, theData, theRepeat):
+	photometric = 'rgb' if len(theData.shape) == 3 and theData.shape[2] == 3 else 'minisblack'
+	best = None
+	for count in range(theRepeat):
+		buffer = io.BytesIO()
+		start = time.perf_counter()
+		with TiffWriter(buffer) as tif:
+			tif.save(theData, photometric=photometric, **theProcessor.getWriteOptions(theData.dtype))
+		elapsed = time.perf_counter() - start
+		best = elapsed if best == None else min(best, elapsed)
+	return (best, buffer.tell())
+
+def main(theArguments=None):
+	parser = argparse.ArgumentParser(description='Benchmark the output presets')
+	parser.add_argument('--width', type=int, default=4000)
+	parser.add_argument('--height', type=int, default=3000)
+	parser.add_argument('--repeat', type=int, default=3, help='best of this many writes is reported (default: 3)')
+	parser.add_argument('--preset', action='append', help='preset to time, repeatable (default: all)')
+	arguments = parser.parse_args(theArguments)
+
+	processor = CalibrationIndiciesProcessor()
+	presets = arguments.preset or list(CalibrationIndiciesProcessor.PRESETS)
+	print('%-20s %-10s %10s %10s %8s' % ('frame', 'preset', 'seconds', 'MB/s', 'ratio'))
+	for name, data in makeFrames(arguments.height, arguments.width):
+		for preset in presets:
+			processor.applyPreset(preset)
+			elapsed, size = timeWrite(processor, data, arguments.repeat)
+			print('%-20s %-10s %10.3f %10.1f %8.2f' % (name, preset, elapsed, data.nbytes / elapsed / 1e6, data.nbytes / size))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
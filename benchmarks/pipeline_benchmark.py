@@ -0,0 +1,204 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+#Throughput and peak memory of each stage of the calibration and index pipeline on synthetic frames, e.g.,
+#	python benchmarks/pipeline_benchmark.py --save-baseline baseline.json
+#	python benchmarks/pipeline_benchmark.py --baseline baseline.json
+#Stages are timed separately (best of --repeat) for every frame size, bit depth and calibration variant, then the whole
+#process() loop is run on a folder of encoded frames. Compared to a baseline, a stage slower by more than --tolerance is
+#reported as a regression and the exit status is 1. Runs offline, the frames are generated from fixed seeds.
+import os, sys, io, json, time, shutil, argparse, platform, tempfile, tracemalloc, resource
+import numpy as np
+import cv2
+import tifffile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tifffile import TiffWriter
+from pmt import RadiometricCalibrator, CalibrationIndiciesProcessor, getIndex
+from pmt.exif_transfer import extractMetadata, getTiffTags
+from synthetic import makeFrame
+
+#Calibration settings timed for every frame, None is the uncalibrated pipeline
+VARIANTS = {
+	'uncalibrated': None,
+	'linear': {'gamma': 0.0, 'subtractionPercent': 0},
+	'gamma': {'gamma': 2.2, 'subtractionPercent': 0},
+	'gamma-subtraction': {'gamma': 2.2, 'subtractionPercent': 20}
+}
+#Slowdowns smaller than this many seconds are timer noise, not regressions
+NOISE_FLOOR = 0.002
+STAGES = ['decode', 'preprocess', 'calibrate', 'index', 'scale', 'encode', 'exif']
+
+class Tag():
+	#Stands in for a pyexiv2 tag so the EXIF stage does not depend on a camera file
+	def __init__(self, theValue):
+		self.raw_value = theValue
+
+EXIF = {'Exif.Image.Make': Tag('Canon'), 'Exif.Image.Model': Tag('PowerShot S110'), 'Exif.Photo.DateTimeOriginal': Tag('2016:04:13 10:30:15'), 'Exif.Photo.ExposureTime': Tag('1/500'), 'Exif.Photo.ISOSpeedRatings': Tag('80'), 'Exif.GPSInfo.GPSLatitudeRef': Tag('N'), 'Exif.GPSInfo.GPSLatitude': Tag('40/1 26/1 4630/100'), 'Exif.GPSInfo.GPSLongitudeRef': Tag('W'), 'Exif.GPSInfo.GPSLongitude': Tag('73/1 58/1 0/1'), 'Exif.GPSInfo.GPSAltitudeRef': Tag('0'), 'Exif.GPSInfo.GPSAltitude': Tag('12345/100'), 'Exif.GPSInfo.GPSDateStamp': Tag('2016:04:13'), 'Exif.GPSInfo.GPSTimeStamp': Tag('14/1 30/1 15/1')}
+
+def makeCalibrator(theVariant, theDtype):
+	calibrator = RadiometricCalibrator()
+	calibrator.maxPixelValue = np.iinfo(theDtype).max
+	calibrator.gamma = theVariant['gamma']
+	calibrator.subtractionPercent = theVariant['subtractionPercent']
+	#Dark, mid and bright targets measured in the same bit depth as the frames
+	scale = calibrator.maxPixelValue / 255.0
+	calibrator.rois = [['dark', [0.1, 0.1, 0.1], [1, 1, 1, 1], [30 * scale, 30 * scale, 30 * scale]], ['mid', [0.4, 0.4, 0.4], [1, 1, 1, 1], [120 * scale, 110 * scale, 130 * scale]], ['bright', [0.8, 0.7, 0.9], [1, 1, 1, 1], [220 * scale, 200 * scale, 230 * scale]]]
+	calibrator.generateModel()
+	return calibrator
+
+def measure(theFunction, theRepeat, theSetup=None):
+	#Best time of theRepeat runs and the peak of memory allocated during a run (NumPy reports to tracemalloc)
+	#An untimed first run keeps one-off costs, e.g., lazily built tables and caches, out of the results
+	theFunction(theSetup() if theSetup != None else None)
+	best = None
+	peak = 0
+	for count in range(theRepeat):
+		argument = theSetup() if theSetup != None else None
+		tracemalloc.start()
+		start = time.perf_counter()
+		theFunction(argument)
+		elapsed = time.perf_counter() - start
+		peak = max(peak, tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+		best = elapsed if best == None else min(best, elapsed)
+	return {'seconds': best, 'peakMB': peak / 1e6}
+
+def benchmarkStages(theMegapixels, theDtype, theVariant, theRepeat):
+	frame = makeFrame(theMegapixels, theDtype)
+	megapixels = frame.shape[0] * frame.shape[1] / 1e6
+	#8 bit frames are decoded from JPEG as from a camera, 16 bit from PNG
+	encoded = cv2.imencode('.jpg' if theDtype == 'uint8' else '.png', frame[:,:,::-1])[1]
+	processor = CalibrationIndiciesProcessor()
+	calibrator = None
+	if VARIANTS[theVariant] != None:
+		calibrator = makeCalibrator(VARIANTS[theVariant], theDtype)
+		processor.radiometricCalibrator = calibrator
+		processor.radiometricCalibration = True
+	product = processor.getProducts()[0]
+	product.update({'index': 'NDVI', 'scaleFrom': 0, 'scaleTo': 255})
+	index = getIndex('NDVI')
+	bands = processor.getBandNumbers()
+	data, calibrated = processor.calibrateImage(frame, calibrator)
+	values = index.evaluate(data, bands)
+
+	results = {}
+	results['decode'] = measure(lambda argument: cv2.cvtColor(cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED), cv2.COLOR_BGR2RGB), theRepeat)
+	if calibrator != None:
+		out = np.empty(frame.shape, dtype='float32')
+		results['preprocess'] = measure(lambda argument: calibrator.preprocessPixels(frame, out=out), theRepeat)
+	results['calibrate'] = measure(lambda argument: processor.calibrateImage(frame, calibrator), theRepeat)
+	results['index'] = measure(lambda argument: index.evaluate(data, bands), theRepeat)
+	#Scaling is in place, so each run gets a fresh copy made outside the timing
+	results['scale'] = measure(lambda argument: processor.castImage(processor.scaleImage(argument, index.minimum, index.maximum, product), product), theRepeat, lambda: values.copy())
+	output = processor.castImage(processor.scaleImage(values.copy(), index.minimum, index.maximum, product), product)
+	def encode(argument):
+		with TiffWriter(io.BytesIO()) as tif:
+			tif.save(output, **processor.getWriteOptions(output.dtype))
+	results['encode'] = measure(encode, theRepeat)
+	results['exif'] = measure(lambda argument: getTiffTags(extractMetadata(EXIF)), theRepeat)
+	for stage in results:
+		results[stage]['megapixelsPerSecond'] = megapixels / results[stage]['seconds'] if results[stage]['seconds'] > 0 else None
+	return results
+
+def benchmarkProcess(theMegapixels, theImages, theWorkers):
+	#End to end process() over a folder of JPEGs, needs pyexiv2 for reading EXIF like any run
+	directory = tempfile.mkdtemp(prefix='pmt-benchmark-')
+	try:
+		source = os.path.join(directory, 'source')
+		os.makedirs(source)
+		for count in range(theImages):
+			cv2.imwrite(os.path.join(source, 'frame%03i.JPG' % count), makeFrame(theMegapixels, 'uint8', count + 1)[:,:,::-1])
+		processor = CalibrationIndiciesProcessor(makeCalibrator(VARIANTS['gamma'], 'uint8'))
+		processor.radiometricCalibration = True
+		start = time.perf_counter()
+		processor.process(source, os.path.join(directory, 'destination'), index='NDVI', resume=False, workers=theWorkers)
+		elapsed = time.perf_counter() - start
+		if len(processor.failedFiles) > 0:
+			raise RuntimeError('%i images failed' % len(processor.failedFiles))
+		return {'seconds': elapsed, 'imagesPerSecond': theImages / elapsed, 'megapixelsPerSecond': theImages * theMegapixels / elapsed}
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+def compare(theResults, theBaseline, theTolerance):
+	#Stages that got slower than the baseline by more than theTolerance, as (key, stage, ratio)
+	regressions = []
+	for key, stages in theResults.items():
+		for stage, result in stages.items():
+			baseline = theBaseline.get(key, {}).get(stage)
+			if baseline == None or not baseline.get('seconds'):
+				continue
+			ratio = result['seconds'] / baseline['seconds']
+			if ratio > 1.0 + theTolerance and result['seconds'] - baseline['seconds'] > NOISE_FLOOR:
+				regressions.append((key, stage, ratio))
+	return regressions
+
+def environment():
+	return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(), 'numpy': np.__version__, 'opencv': cv2.__version__, 'tifffile': tifffile.__version__}
+
+def main(theArguments=None):
+	parser = argparse.ArgumentParser(description='Benchmark the calibration and index pipeline')
+	parser.add_argument('--sizes', default='1,4,12,24,40', help='frame sizes in megapixels (default: 1,4,12,24,40)')
+	parser.add_argument('--dtypes', default='uint8,uint16', help='frame bit depths (default: uint8,uint16)')
+	parser.add_argument('--variants', default=','.join(VARIANTS), help='calibration variants (default: %s)' % ','.join(VARIANTS))
+	parser.add_argument('--repeat', type=int, default=3, help='best of this many runs is reported (default: 3)')
+	parser.add_argument('--process-images', dest='processImages', type=int, default=8, help='images in the end to end process() run, 0 skips it (default: 8)')
+	parser.add_argument('--process-size', dest='processSize', type=float, default=12, help='megapixels of the process() images (default: 12)')
+	parser.add_argument('--workers', type=int, default=1, help='workers for the process() run (default: 1)')
+	parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.15, help='slowdown relative to the baseline reported as a regression (default: 0.15)')
+	parser.add_argument('--save-baseline', dest='saveBaseline', help='write the results as JSON, e.g., to use as --baseline later')
+	arguments = parser.parse_args(theArguments)
+
+	results = {}
+	print('%-32s %-11s %10s %10s %10s' % ('frame', 'stage', 'seconds', 'MP/s', 'peak MB'))
+	for size in [float(value) for value in arguments.sizes.split(',')]:
+		for dtype in arguments.dtypes.split(','):
+			for variant in arguments.variants.split(','):
+				key = '%gMP-%s-%s' % (size, dtype, variant)
+				results[key] = benchmarkStages(size, dtype, variant, arguments.repeat)
+				for stage in STAGES:
+					if stage in results[key]:
+						result = results[key][stage]
+						print('%-32s %-11s %10.4f %10.1f %10.1f' % (key, stage, result['seconds'], result['megapixelsPerSecond'] or 0, result['peakMB']))
+	if arguments.processImages > 0:
+		key = '%gMP-uint8-process' % arguments.processSize
+		results[key] = {'process': benchmarkProcess(arguments.processSize, arguments.processImages, arguments.workers)}
+		result = results[key]['process']
+		print('%-32s %-11s %10.4f %10.1f %10s   %.2f images/s' % (key, 'process', result['seconds'], result['megapixelsPerSecond'], '', result['imagesPerSecond']))
+	#Peak resident memory of the whole benchmark, kB on Linux
+	print('Peak resident memory: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3))
+
+	if arguments.saveBaseline != None:
+		with open(arguments.saveBaseline, 'w') as file:
+			json.dump({'environment': environment(), 'results': results}, file, indent=1, sort_keys=True)
+	if arguments.baseline != None:
+		with open(arguments.baseline, 'r') as file:
+			baseline = json.load(file)
+		if baseline['environment'] != environment():
+			print('Note: the baseline was recorded in a different environment, %s' % json.dumps(baseline['environment']))
+		regressions = compare(results, baseline['results'], arguments.tolerance)
+		for key, stage, ratio in regressions:
+			print('REGRESSION %s %s is %.2fx the baseline time' % (key, stage, ratio))
+		if len(regressions) > 0:
+			return 1
+		print('No regressions against %s' % arguments.baseline)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
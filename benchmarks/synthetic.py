@@ -0,0 +1,38 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+#Reproducible synthetic frames for the benchmarks: smooth variation across the frame, like vegetation and soil patches,
+#plus sensor-like noise, from fixed seeds so every run times the same pixels.
+import numpy as np
+import cv2
+
+def makeField(theHeight, theWidth, theBands, theSeed, theNoise=0.01):
+	#Float32 values in [0, 1], shape (height, width, bands)
+	random = np.random.default_rng(theSeed)
+	coarse = random.random((max(2, theHeight // 200), max(2, theWidth // 200), theBands)).astype('float32')
+	field = cv2.resize(coarse, (theWidth, theHeight), interpolation=cv2.INTER_CUBIC).reshape(theHeight, theWidth, theBands)
+	field += random.standard_normal(field.shape, dtype='float32') * theNoise
+	return np.clip(field, 0.0, 1.0, out=field)
+
+def makeFrame(theMegapixels, theDtype='uint8', theSeed=1):
+	#Three band camera frame of about theMegapixels with a 4:3 aspect ratio
+	height = int(round((theMegapixels * 1e6 * 3 / 4) ** 0.5))
+	width = int(round(height * 4 / 3))
+	field = makeField(height, width, 3, theSeed)
+	maximum = np.iinfo(theDtype).max
+	return (field * maximum).astype(theDtype)
@@ -19,6 +19,9 @@
 import os, glob, datetime
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 
+from pmt.indicies import INDICIES
+from pmt.palettes import PALETTES
+
 INDICIES_WIDGET, _ = uic.loadUiType(os.path.join(os.path.dirname(__file__), 'calibration_indicies_dialog.ui'))
 
 class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
@@ -37,12 +40,21 @@ class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
 
 		self.processor.message.connect(self.log)
 		self.processor.progress.connect(self.progressBar.setValue)
+		self.processor.throughput.connect(self.showThroughput)
+		self.processor.finished.connect(self.processingFinished)
 
 		self.setWindowTitle('Calibration & Indicies')
+		#Offer every registered index, including ones added with registerIndex()
+		for name in INDICIES:
+			if self.comboBoxIndex.findText(name) < 0:
+				self.comboBoxIndex.addItem(name)
+		for name in PALETTES:
+			self.comboBoxLut.addItem(name)
 		self.checkBoxRadiometricCalibration.stateChanged.connect(self.toggleCalibration)
 		self.spinBoxMin.valueChanged.connect(self.setMin)
 		self.spinBoxMax.valueChanged.connect(self.setMax)
 		self.comboBoxLut.currentIndexChanged.connect(self.setLut)
+		self.checkBoxLutRgb.stateChanged.connect(self.setLutMode)
 		self.comboBoxIndex.currentIndexChanged.connect(self.setIndex)
 		self.comboBoxRedBand.currentIndexChanged.connect(self.setRedBand)
 		self.comboBoxNirBand.currentIndexChanged.connect(self.setNirBand)
@@ -50,6 +62,14 @@ class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
 		self.pushButtonSource.clicked.connect(self.setSource)
 		self.pushButtonDestination.clicked.connect(self.setDestination)
 		self.pushButtonRun.clicked.connect(self.run)
+		self.pushButtonCancel.clicked.connect(self.cancel)
+		self.spinBoxWorkers.setMaximum(max(1, os.cpu_count() or 1))
+		self.spinBoxWorkers.valueChanged.connect(self.setWorkers)
+
+	def cancel(self):
+		self.pushButtonCancel.setEnabled(False)
+		self.log('Cancelling, waiting for the images in progress to finish')
+		self.processor.cancel()
 
 	def checkDirectories(self):
 		if self.source == '' or self.destination == '':
@@ -76,9 +96,18 @@ class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
 	def log(self, theMessage):
 		self.textBrowser.append(datetime.datetime.now().isoformat()+': '+theMessage)
 
+	def processingFinished(self, theResult):
+		self.pushButtonCancel.setEnabled(False)
+		self.pushButtonRun.setEnabled(True)
+		self.spinBoxWorkers.setEnabled(True)
+
 	def run(self):
 		self.progressBar.setValue(0)
-		self.processor.process(self.source, self.destination)
+		self.labelThroughput.setText('')
+		if self.processor.process(self.source, self.destination):
+			self.pushButtonRun.setEnabled(False)
+			self.spinBoxWorkers.setEnabled(False)
+			self.pushButtonCancel.setEnabled(True)
 
 	def setDestination(self):
 		self.destination = QtWidgets.QFileDialog.getExistingDirectory(self)
@@ -100,6 +129,9 @@ class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
 	def setLut(self, theIndex):
 		self.processor.lut = self.comboBoxLut.currentText()
 
+	def setLutMode(self, theState):
+		self.processor.lutMode = 'rgb' if theState == QtCore.Qt.Checked else 'palette'
+
 	def setMax(self, theValue):
 		self.processor.scaleTo = theValue
 		self.toggleLut()
@@ -120,6 +152,14 @@ class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
 		else: 
 			self.source = ''
 
+	def setWorkers(self, theValue):
+		self.processor.workers = theValue
+
+	def showThroughput(self, theRate):
+		if theRate > 0:
+			remaining = (self.progressBar.maximum() - self.progressBar.value()) / theRate
+			self.labelThroughput.setText(str.format('{0:.2f} images/s, ETA {1}', theRate, str(datetime.timedelta(seconds=int(remaining)))))
+
 	def toggleCalibration(self, theState):
 		if theState == QtCore.Qt.Checked:
 			self.processor.radiometricCalibration = True
@@ -133,6 +173,7 @@ class CalibrationIndiciesDialog(QtWidgets.QWidget, INDICIES_WIDGET):
 			self.comboBoxLut.setEnabled(False)
 		else:
 			self.comboBoxLut.setEnabled(True)
+		self.checkBoxLutRgb.setEnabled(self.comboBoxLut.isEnabled())
 
 	def updateFileExtension(self):
 		self.fileExtension = self.lineEditFileExtension.text()
@@ -16,25 +16,91 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import time
 import numpy as np
 
 from PyQt5 import QtCore, QtGui
 from pmt import CalibrationIndiciesProcessor
 
+class ProcessingThread(QtCore.QThread):
+	def __init__(self, theProcessor, theSourceDir, theDestinationDir, theSettings):
+		QtCore.QThread.__init__(self)
+		#The batch runs on a snapshot of the settings and calibrator taken here, on the GUI thread, so edits made in the
+		#dialogs while it runs apply to the next run rather than part way through this one
+		self.processor = theProcessor.copy()
+		self.processor.applySettings(theSettings)
+		self.processor.log = theProcessor.log
+		self.sourceDir = theSourceDir
+		self.destinationDir = theDestinationDir
+		self.result = False
+
+	def run(self):
+		self.result = self.processor.process(self.sourceDir, self.destinationDir)
+
 class CalibrationIndiciesProcessorQt(QtCore.QObject, CalibrationIndiciesProcessor):
 	progress = QtCore.pyqtSignal(int)
 	message = QtCore.pyqtSignal(str)
+	throughput = QtCore.pyqtSignal(float)
+	finished = QtCore.pyqtSignal(bool)
+
+	#Minimum seconds between signals, thousands of per image messages would otherwise flood the GUI
+	LOG_INTERVAL = 0.25
 
 	def __init__(self, theCalibrator=None):
 		QtCore.QObject.__init__(self)
 		CalibrationIndiciesProcessor.__init__(self)
 		self.radiometricCalibrator = theCalibrator
+		self.processingThread = None
+		self.pendingMessages = []
+		self.pendingProgress = None
+		self.lastEmit = 0.0
+		self.rateStart = None
+
+	def cancel(self):
+		CalibrationIndiciesProcessor.cancel(self)
+		if self.isRunning():
+			self.processingThread.processor.cancel()
+
+	def flush(self):
+		if self.pendingProgress != None:
+			self.progress.emit(self.pendingProgress)
+			#Rate is measured from the first progress report so images skipped as up to date are not counted
+			now = time.time()
+			if self.rateStart == None:
+				self.rateStart = (now, self.pendingProgress)
+			elif now > self.rateStart[0]:
+				self.throughput.emit((self.pendingProgress - self.rateStart[1]) / (now - self.rateStart[0]))
+			self.pendingProgress = None
+		if len(self.pendingMessages) > 0:
+			self.message.emit('\n'.join(self.pendingMessages))
+			self.pendingMessages = []
+		self.lastEmit = time.time()
+
+	def isRunning(self):
+		return self.processingThread != None and self.processingThread.isRunning()
 
 	def log(self, theMessage, **kwargs):
+		#Called from the processing thread, signals are queued to the GUI thread
 		if 'progress' in kwargs:
-			self.progress.emit(kwargs['progress'])
-		self.message.emit(theMessage)
+			self.pendingProgress = kwargs['progress']
+		self.pendingMessages.append(theMessage)
+		if time.time() - self.lastEmit >= self.LOG_INTERVAL:
+			self.flush()
+
+	def process(self, theSourceDir, theDestinationDir, **kwargs):
+		#Runs the batch on a worker thread, finished is emitted with the result
+		if self.isRunning():
+			return False
+		self.pendingMessages = []
+		self.pendingProgress = None
+		self.lastEmit = 0.0
+		self.rateStart = None
+		self.processingThread = ProcessingThread(self, theSourceDir, theDestinationDir, kwargs)
+		self.processingThread.finished.connect(self.processingFinished)
+		self.processingThread.start()
+		return True
 
-	def process(self, theSourceDir, theDestinationDir):
-		#TODO: This needs to be spawned off in new thread
-		CalibrationIndiciesProcessor.process(self, theSourceDir, theDestinationDir)
\ No newline at end of file
+	def processingFinished(self):
+		self.failedFiles = self.processingThread.processor.failedFiles
+		self.flush()
+		self.finished.emit(self.processingThread.result)
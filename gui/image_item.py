@@ -0,0 +1,48 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+def wrapImage(theArray):
+	#QImage sharing the memory of a contiguous (rows, columns, 3) uint8 RGB array, the array has to outlive it
+	return QtGui.QImage(theArray.data, theArray.shape[1], theArray.shape[0], theArray.strides[0], QtGui.QImage.Format_RGB888)
+
+class ImageGraphicsItem(QtWidgets.QGraphicsItem):
+	#Draws an RGB array without converting it to a QPixmap, i.e., without a second, 4 bytes per pixel copy
+	def __init__(self, theArray, parent=None):
+		QtWidgets.QGraphicsItem.__init__(self, parent)
+		#Only the exposed part of the image is drawn
+		self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+		self.array = None
+		self.image = None
+		self.setArray(theArray)
+
+	def boundingRect(self):
+		return QtCore.QRectF(0, 0, self.image.width(), self.image.height())
+
+	def paint(self, thePainter, theOption, theWidget=None):
+		rect = theOption.exposedRect.intersected(self.boundingRect())
+		thePainter.drawImage(rect, self.image, rect)
+
+	def setArray(self, theArray):
+		#The item keeps theArray alive for as long as its QImage is drawn
+		self.prepareGeometryChange()
+		self.array = np.ascontiguousarray(theArray)
+		self.image = wrapImage(self.array)
+		self.update()
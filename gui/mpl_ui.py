@@ -16,6 +16,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import numpy as np
 from PyQt5 import QtWidgets
 import matplotlib
 matplotlib.use('Qt5Agg')
@@ -27,8 +28,6 @@ class MplCanvas(FigureCanvas):
 	def __init__(self, parent=None, width=4, height=4, dpi=60):
 		fig = Figure(figsize=(width, height), dpi=dpi)
 		self.plot = fig.add_subplot(111)
-		# We want the axes cleared every time plot() is called
-		self.plot.hold(False)
 
 		self.compute_initial_figure()
 
@@ -42,16 +41,22 @@ class MplCanvas(FigureCanvas):
 		pass
 
 class MplLinearRegressionCanvas(MplCanvas):
-	def plotModel(self, theModelBand, theColor):
-		y = []
-		for x in theModelBand['data']['x']:
-			y.append((theModelBand['slope']*x) + theModelBand['intercept'])
-		self.plot.plot(theModelBand['data']['x'], theModelBand['data']['y'], 'gs', theModelBand['data']['x'], y, color=theColor, linewidth=2)
-		self.plot.set_title('R-value: '+str(theModelBand['r-value']))
+	def compute_initial_figure(self):
+		#The artists are created once and only their data is updated, replotting the axes is much slower
+		self.points, = self.plot.plot([], [], 'gs')
+		self.line, = self.plot.plot([], [], linewidth=2)
 		self.plot.locator_params(nbins=5)
 		self.plot.set_xlim(xmin=0, xmax=1)
 		self.plot.set_ylim(ymin=0, ymax=1)
-		self.draw()
+
+	def plotModel(self, theModelBand, theColor):
+		x = np.array(theModelBand['data']['x'], dtype='float64')
+		self.points.set_data(x, theModelBand['data']['y'])
+		self.line.set_data(x, (theModelBand['slope']*x) + theModelBand['intercept'])
+		self.line.set_color(theColor)
+		self.plot.set_title('R-value: '+str(theModelBand['r-value']))
+		#Redraw once control returns to the event loop, several updates in a row are drawn only once
+		self.draw_idle()
 
 
 class MplLinearRegressionWidget(QtWidgets.QWidget):
@@ -17,10 +17,11 @@
 # You should have received a copy of the GNU General Public License
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
 import sys, os, csv
-import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 
 from gui.mpl_ui import MplLinearRegressionWidget
+from gui.image_item import ImageGraphicsItem
+from pmt.indicies import INDICIES
 
 
 
@@ -31,7 +32,10 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 		QtWidgets.QWidget.__init__(self)
 		self.setupUi(self)
 		self.currentRoi = None
-		self.pixmap = None
+		self.imageItem = None
+		#Scene items for the highlighted ROI and the preview layer over the image
+		self.roiItem = None
+		self.previewItem = None
 		self.rois = []
 		self.roiRects = []
 		self.baseWindowTitle = "Target Calibration"
@@ -40,9 +44,21 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 		self.calibrator = theCalibrator
 		self.loadRois(theCalibrator.rois)
 
-		self.calibrator.pixmapCreated.connect(self.setPixmap)
+		self.calibrator.imageCreated.connect(self.setImage)
 		self.calibrator.roisLoaded.connect(self.loadRois)
 		self.calibrator.modelCreated.connect(self.plotModel)
+		self.calibrator.modelCreated.connect(self.refreshPreview)
+
+		self.comboBoxPreview.addItem('Image')
+		self.comboBoxPreview.addItem('Calibrated')
+		for name in INDICIES:
+			self.comboBoxPreview.addItem(name)
+		self.comboBoxPreview.currentIndexChanged.connect(self.refreshPreview)
+		#Scrolling renders the newly visible part of the full resolution preview, once scrolling pauses
+		self.previewTimer = QtCore.QTimer(self)
+		self.previewTimer.setSingleShot(True)
+		self.previewTimer.setInterval(50)
+		self.previewTimer.timeout.connect(self.renderPreview)
 
 		self.cboxGammaCorrection.stateChanged.connect(self.toggleGamma)
 		self.dsboxGamma.valueChanged.connect(self.calibrator.setGamma)
@@ -56,6 +72,8 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 		self.graphicsView.setScene(self.scene)
 		self.graphicsView.setDragMode(QtWidgets.QGraphicsView.RubberBandDrag)
 		self.graphicsView.rubberBandChanged.connect(self.recordRubberBand)
+		self.graphicsView.horizontalScrollBar().valueChanged.connect(self.scrollPreview)
+		self.graphicsView.verticalScrollBar().valueChanged.connect(self.scrollPreview)
 
 		self.tableWidget.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
 		self.tableWidget.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
@@ -120,11 +138,16 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 				calibrationData[theColumn - 1] = float(item.text())
 				self.calibrator.setRois(self.rois)
 
+	def clearScene(self):
+		self.scene.clear()
+		self.imageItem = None
+		self.roiItem = None
+		self.previewItem = None
+
 	def deleteRoi(self):
 		currentRow = self.tableWidget.currentRow()
 		if currentRow != -1:
-			if len(self.scene.items()) == 2:
-				self.scene.removeItem(self.scene.items()[0])
+			self.removeRoiItem()
 			self.tableWidget.removeRow(currentRow)
 			self.rois.remove(self.rois[currentRow])
 			self.roiRects.remove(self.roiRects[currentRow])
@@ -133,9 +156,9 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 
 	def displayRoi(self, theRow):
 		if self.roiRects[theRow].width() != 0:
-			if len(self.scene.items()) == 2:
-				self.scene.removeItem(self.scene.items()[0])
-			self.scene.addRect(QtCore.QRectF(self.roiRects[theRow]), QtGui.QPen(QtGui.QBrush(QtCore.Qt.yellow, QtCore.Qt.SolidPattern), 4))
+			self.removeRoiItem()
+			self.roiItem = self.scene.addRect(QtCore.QRectF(self.roiRects[theRow]), QtGui.QPen(QtGui.QBrush(QtCore.Qt.yellow, QtCore.Qt.SolidPattern), 4))
+			self.roiItem.setZValue(2)
 			self.graphicsView.centerOn(self.roiRects[theRow].center())
 
 	def loadFromFile(self):
@@ -149,7 +172,7 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 						self.addRoi(newRoi)
 
 	def loadImage(self):
-		self.scene.clear()
+		self.clearScene()
 		fileName = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Image')
 		if not fileName[0] == '':		
 			self.calibrator.loadImage(fileName[0])
@@ -165,19 +188,23 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 		self.mplWidgetGreen.plotModel(theModel[1], 'green')
 		self.mplWidgetBlue.plotModel(theModel[2], 'blue')
 
+	def previewFactor(self):
+		#Coarsest pyramid level that still has at least one pixel per screen pixel, full resolution once zoomed in
+		scale = self.graphicsView.transform().m11() * self.calibrator.reduction
+		factor = 1
+		for level in self.calibrator.PYRAMID_FACTORS:
+			if scale * level <= 1.0:
+				factor = level
+		return factor
+
 	def recordRubberBand(self, theRect, fromScenePoint, toSceenPoint):
 		if theRect.width() == 0 and theRect.height() == 0:
 			newRoi = QtCore.QRectF(self.currentRoi)
 			newRoi.setTopLeft(self.graphicsView.mapToScene(self.currentRoi.topLeft()))
 			newRoi.setBottomRight(self.graphicsView.mapToScene(self.currentRoi.bottomRight()))
 			
-			qImage = self.pixmap.copy(newRoi.toRect()).toImage()
-			pixels = []
-			for y in range(qImage.height()):
-				for x in range(qImage.width()):
-					pixel = QtGui.QColor(qImage.pixel(x, y))
-					pixels.append([pixel.red(), pixel.green(), pixel.blue()])
-			means = np.mean(pixels, axis=0).tolist()
+			rect = newRoi.toRect()
+			means = self.calibrator.roiStatistics(rect.x(), rect.y(), rect.width(), rect.height())['mean']
 
 			currentRow = self.tableWidget.currentRow()
 			if currentRow != -1:
@@ -197,15 +224,65 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 		else:
 			self.currentRoi = theRect
 
+	def refreshPreview(self):
+		self.previewTimer.stop()
+		self.renderPreview()
+
+	def removeRoiItem(self):
+		if self.roiItem != None:
+			self.scene.removeItem(self.roiItem)
+			self.roiItem = None
+
+	def renderPreview(self):
+		mode = self.comboBoxPreview.currentText()
+		if self.imageItem == None or self.calibrator.image is None or mode == 'Image':
+			if self.previewItem != None:
+				self.scene.removeItem(self.previewItem)
+				self.previewItem = None
+			return
+		factor = self.previewFactor()
+		level = self.calibrator.pyramid[factor]
+		#Scene coordinates are full resolution pixels, whatever the size the image was decoded at
+		scaleX = self.calibrator.image.shape[1] * self.calibrator.reduction / float(level.shape[1])
+		scaleY = self.calibrator.image.shape[0] * self.calibrator.reduction / float(level.shape[0])
+		rect = None
+		x, y = (0, 0)
+		if factor == 1:
+			#Only the visible part is computed at full resolution
+			visible = self.graphicsView.mapToScene(self.graphicsView.viewport().rect()).boundingRect()
+			visible = QtCore.QRectF(visible.x() / scaleX, visible.y() / scaleY, visible.width() / scaleX, visible.height() / scaleY).toAlignedRect()
+			visible = visible.intersected(QtCore.QRect(0, 0, level.shape[1], level.shape[0]))
+			if visible.isEmpty():
+				return
+			x, y = (visible.x(), visible.y())
+			rect = (x, y, visible.width(), visible.height())
+		image = self.calibrator.previewImage(mode, factor, rect)
+		if self.previewItem == None:
+			self.previewItem = ImageGraphicsItem(image)
+			self.previewItem.setZValue(1)
+			self.scene.addItem(self.previewItem)
+		else:
+			self.previewItem.setArray(image)
+		#Stretch the level back over the full resolution image
+		self.previewItem.setPos(x * scaleX, y * scaleY)
+		self.previewItem.setTransform(QtGui.QTransform.fromScale(scaleX, scaleY))
+
 	def saveRois(self):
 		self.calibrator.save()
 
-	@QtCore.pyqtSlot(QtGui.QPixmap, str)
-	def setPixmap(self, thePixmap):
-		if thePixmap != None:
-			self.scene.clear()
-			self.pixmap = thePixmap
-			self.scene.addPixmap(thePixmap)
+	def scrollPreview(self):
+		#Only the full resolution preview depends on the visible area
+		if self.previewItem != None and self.previewFactor() == 1:
+			self.previewTimer.start()
+
+	def setImage(self, theImage):
+		if theImage is not None:
+			self.clearScene()
+			#Drawn straight from the calibrator's buffer. Reduced decodes are drawn at full size so ROIs keep their
+			#full resolution coordinates.
+			self.imageItem = ImageGraphicsItem(theImage)
+			self.imageItem.setScale(self.calibrator.reduction)
+			self.scene.addItem(self.imageItem)
 			self.setWindowTitle(self.baseWindowTitle + " [ " + os.path.basename(self.calibrator.fileName) + " ]")
 
 			#set the other gui components
@@ -222,6 +299,7 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 				self.cboxFromBand.setCurrentIndex(self.calibrator.subtractionFromBand - 1)
 			else:
 				self.cboxSubtraction.setCheckState(QtCore.Qt.Unchecked)
+			self.refreshPreview()
 
 	def subtractionParametersChanged(self):
 		self.calibrator.setSubtractionParameters(self.sboxPercent.value(), self.cboxSourceBand.currentIndex()+1, self.cboxFromBand.currentIndex()+1)
@@ -247,8 +325,10 @@ class RadiometricCalibrationDialog(QtWidgets.QWidget, CALIBRATION_WIDGET):
 
 	def zoomIn(self):
 		self.graphicsView.scale(2,2)
+		self.refreshPreview()
 
 	def zoomOut(self):
 		self.graphicsView.scale(0.5,0.5)
+		self.refreshPreview()
 
 
@@ -17,27 +17,89 @@
 # You should have received a copy of the GNU General Public License
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
 import numpy as np
+import cv2
 
-from PyQt5 import QtCore, QtGui
-from pmt import RadiometricCalibrator
+from PyQt5 import QtCore
+from pmt import RadiometricCalibrator, getIndex, getPalette
+from pmt.radiometric_calibrator import pixelMaximum
 
 class RadiometricCalibratorQt(QtCore.QObject, RadiometricCalibrator):
 	modelCreated = QtCore.pyqtSignal(list)
-	pixmapCreated = QtCore.pyqtSignal(QtGui.QPixmap)
+	#RGB uint8 array to display, the loaded image itself unless it has to be converted to 8 bit
+	imageCreated = QtCore.pyqtSignal(object)
 	roisLoaded = QtCore.pyqtSignal(list)
+	#Milliseconds without further changes before modelCreated is emitted
+	MODEL_DELAY = 150
+	#Downsampling factors of the preview pyramid, i.e., 1/4 and 1/16 of the pixels. Full resolution is factor 1.
+	PYRAMID_FACTORS = [2, 4]
 
 	def __init__(self):
 		QtCore.QObject.__init__(self)
 		RadiometricCalibrator.__init__(self)
+		#The model itself is always current, only the signal (and so the plot redraws) is coalesced while the
+		#gamma spin box is dragged or ROI cells are edited
+		self.modelTimer = QtCore.QTimer(self)
+		self.modelTimer.setSingleShot(True)
+		self.modelTimer.setInterval(self.MODEL_DELAY)
+		self.modelTimer.timeout.connect(self.emitModel)
+		#Whether the last generateModel() failed, its model is then not emitted
+		self.modelFailed = False
+		#Downsampled copies of the loaded image by factor, built once per image for the preview
+		self.pyramid = {}
+		#Bands the preview indices are computed from, same defaults as the processor
+		self.previewBands = {'red': 1, 'green': 2, 'blue': 3, 'nir': 3}
+		self.previewLut = 'NDVI'
+
+	def buildPyramid(self):
+		#Each level is area averaged from the previous one
+		self.pyramid = {1: self.image}
+		level = self.image
+		for factor in self.PYRAMID_FACTORS:
+			level = cv2.resize(level, (max(1, self.image.shape[1] // factor), max(1, self.image.shape[0] // factor)), interpolation=cv2.INTER_AREA)
+			self.pyramid[factor] = level
+
+	def emitModel(self):
+		if self.model != None and not self.modelFailed:
+			self.modelCreated.emit(self.model)
 
 	def generateModel(self):
 		if RadiometricCalibrator.generateModel(self):
-			self.modelCreated.emit(self.model)
+			self.modelFailed = False
+			#Restarting the timer drops the emit of any previous change that is still pending
+			self.modelTimer.start()
+			return True
+		#A pending emit would show the model of an earlier fit
+		self.modelFailed = True
+		self.modelTimer.stop()
+		return False
+
 	def loadImage(self, theImage):
 		if RadiometricCalibrator.loadImage(self, theImage):
-			qImage = QtGui.QImage(self.image, self.image.shape[1], self.image.shape[0], QtGui.QImage.Format_RGB888)
-			self.pixmapCreated.emit(QtGui.QPixmap.fromImage(qImage))
+			#8 bit images are displayed from the same buffer the ROI statistics are sampled from, deeper and
+			#linear images from an 8 bit copy
+			self.buildPyramid()
+			self.imageCreated.emit(self.getDisplayImage())
 			self.roisLoaded.emit(self.rois)
 		else:
 			return False
-		return True
\ No newline at end of file
+		return True
+
+	def previewImage(self, theMode, theFactor=1, theRect=None):
+		#8 bit RGB rendering of a pyramid level, theMode is 'Calibrated' or an index name and theRect an optional
+		#(x, y, width, height) of the level, e.g., the visible part of the full resolution image
+		image = self.pyramid[theFactor]
+		if theRect != None:
+			x, y, width, height = theRect
+			image = image[y:y+height, x:x+width]
+		data = np.empty(image.shape, dtype='float32')
+		if self.model != None:
+			self.calibrate(image, out=data, maxValue=pixelMaximum(image))
+		else:
+			np.multiply(image, 1.0 / pixelMaximum(image), out=data, casting='unsafe')
+		if theMode == 'Calibrated':
+			np.multiply(data, 255.0, out=data)
+			return np.clip(data, 0, 255).astype('uint8')
+		index = getIndex(theMode)
+		values = index.evaluate(data, self.previewBands)[:,:,0]
+		values = (values - index.minimum) * (255.0 / (index.maximum - index.minimum))
+		return np.take(getPalette(self.previewLut), np.clip(values, 0, 255).astype('uint8'), axis=0)
@@ -18,3 +18,9 @@
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
 from pmt.radiometric_calibrator import RadiometricCalibrator
 from pmt.calibration_indicies_processor import CalibrationIndiciesProcessor
+from pmt.processing_manifest import ProcessingManifest
+from pmt.calibration_library import CalibrationLibrary
+from pmt.indicies import VegetationIndex, getIndex, registerIndex
+from pmt.palettes import getPalette, registerPalette
+from pmt.output_statistics import IndexStatistics, OutputStatistics
+from pmt.instrumentation import Instrumentation, ImageRecord, CallbackSink, JsonLinesSink, PrometheusSink
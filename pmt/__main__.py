@@ -0,0 +1,197 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+#Headless batch runner, e.g.,
+#	python -m pmt SOURCE DESTINATION --calibration target-calibration.jpg --index NDVI --workers 8
+#	python -m pmt --job jobs.json
+#A job file holds a list of jobs (or {"jobs": [...]}), each with "source" and "destination", optionally "calibration" (a
+#calibration image or a .json model file written by RadiometricCalibrator.saveModel()), "calibrationLibrary" (a list of
+#them, picked per image by capture time) with "calibrationMode",
+#"preset" (applied before the other settings), "products" (a list of {"index", "scaleFrom", "scaleTo", "lut", "name"}), "defineIndex" (a list of NAME=EXPRESSION[:MIN:MAX] as for --define-index),
+#and any CalibrationIndiciesProcessor setting by attribute name, e.g., {"index": "NDVI", "scaleTo": 255, "workers": 8}.
+#Progress is printed to stdout as one JSON object per line.
+import sys, json, time, argparse
+
+from pmt import RadiometricCalibrator, CalibrationIndiciesProcessor, CalibrationLibrary, OutputStatistics, Instrumentation, JsonLinesSink, PrometheusSink, registerIndex
+
+class CommandLineProcessor(CalibrationIndiciesProcessor):
+	def __init__(self, theCalibrator=None):
+		CalibrationIndiciesProcessor.__init__(self, theCalibrator)
+		self.job = 0
+
+	def log(self, theMessage, **kwargs):
+		record = {'time': time.time(), 'job': self.job, 'message': theMessage.strip()}
+		if 'progress' in kwargs:
+			record['progress'] = kwargs['progress']
+		sys.stdout.write(json.dumps(record) + '\n')
+		sys.stdout.flush()
+
+def parseProduct(theSpecification):
+	#[NAME=]INDEX[:FROM:TO[:LUT]]
+	product = {}
+	specification = theSpecification
+	if '=' in specification:
+		product['name'], specification = specification.split('=', 1)
+	parts = specification.split(':')
+	if len(parts) not in (1, 3, 4):
+		raise argparse.ArgumentTypeError('expected [NAME=]INDEX[:FROM:TO[:LUT]], got %s' % theSpecification)
+	product['index'] = parts[0]
+	if len(parts) > 1:
+		for key, value in (('scaleFrom', parts[1]), ('scaleTo', parts[2])):
+			try:
+				product[key] = float(value) if float(value) != int(float(value)) else int(float(value))
+			except ValueError:
+				raise argparse.ArgumentTypeError('invalid scale %s in %s' % (value, theSpecification))
+	if len(parts) == 4:
+		product['lut'] = parts[3]
+	return product
+
+def parseArguments(theArguments):
+	parser = argparse.ArgumentParser(prog='python -m pmt', description='Radiometric calibration and vegetation indices for a folder of images, without a GUI.')
+	parser.add_argument('source', nargs='?', help='folder of images to process')
+	parser.add_argument('destination', nargs='?', help='folder to write the processed images to')
+	parser.add_argument('--job', help='JSON job file listing one or more jobs, used instead of source and destination')
+	parser.add_argument('--calibration', help='calibration image with saved ROIs, or a saved .json calibration model; enables radiometric calibration. With --calibration-library it is used for images without a capture time, which otherwise fail')
+	parser.add_argument('--calibration-library', dest='calibrationLibrary', nargs='+', help='calibration images or .json models from target shots taken through the flight; each image uses the one closest to its capture time')
+	parser.add_argument('--calibration-mode', dest='calibrationMode', choices=CalibrationLibrary.MODES, default='nearest', help='use the nearest calibration or interpolate between the two bracketing ones (default: nearest)')
+	parser.add_argument('--index', default='None', help='vegetation index to compute, e.g., NDVI, or several separated by commas, e.g., None,NDVI,SAVI where None is the (calibrated) image (default: None)')
+	parser.add_argument('--define-index', dest='defineIndex', action='append', metavar='NAME=EXPRESSION[:MIN:MAX]', help='add an index from an expression of red, green, blue, nir and b1 - b3, e.g., NDRE=(nir-b2)/(nir+b2):-1:1, repeatable')
+	parser.add_argument('--product', dest='products', action='append', type=parseProduct, metavar='[NAME=]INDEX[:FROM:TO[:LUT]]', help='output to write from the same decode and calibration, e.g., R=None:0:1 for float reflectance or NDVI:0:255, repeatable; replaces --index')
+	parser.add_argument('--lut', default='None', help='colormap for 8 bit index output, e.g., NDVI, RdYlGn, Jet, Fire, Viridis or a matplotlib colormap name (default: None)')
+	parser.add_argument('--lut-mode', dest='lutMode', choices=['palette', 'rgb'], default='palette', help='write colormapped output as an indexed color TIFF or as RGB (default: palette)')
+	parser.add_argument('--red-band', dest='redBand', type=int, default=1, help='band holding red (default: 1)')
+	parser.add_argument('--green-band', dest='greenBand', type=int, default=2, help='band holding green (default: 2)')
+	parser.add_argument('--blue-band', dest='blueBand', type=int, default=3, help='band holding blue (default: 3)')
+	parser.add_argument('--nir-band', dest='nirBand', type=int, default=3, help='band holding NIR (default: 3)')
+	parser.add_argument('--scale-from', dest='scaleFrom', type=float, default=0, help='output value for the bottom of the range (default: 0)')
+	parser.add_argument('--scale-to', dest='scaleTo', type=float, default=255, help='output value for the top of the range, 1 for float, > 255 for 16 bit (default: 255)')
+	parser.add_argument('--extension', dest='fileExtension', default='JPG', help='extension of the files to process (default: JPG)')
+	parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+	parser.add_argument('--pipeline', action='store_true', help='overlap decoding, computing and encoding with threads')
+	parser.add_argument('--tile-size', dest='tileSize', type=int, default=0, help='process and write tiles of this size, for very large frames')
+	parser.add_argument('--preview', dest='reduction', type=int, choices=[2, 4, 8], default=1, help='quick look run, decode at 1/2, 1/4 or 1/8 size (JPEGs without a full decode) and name the outputs e.g. NDVI-IMG_0001-1of4.tiff')
+	parser.add_argument('--preset', choices=list(CalibrationIndiciesProcessor.PRESETS), help='output compression preset, fast, balanced or archive trade speed for size (default: deflate level 6)')
+	parser.add_argument('--compression', choices=list(CalibrationIndiciesProcessor.COMPRESSIONS), help='output codec, overrides the preset; lzw and zstd need imagecodecs')
+	parser.add_argument('--compression-level', dest='compressionLevel', type=int, help='codec level, e.g., 1 - 9 for deflate')
+	parser.add_argument('--predictor', action='store_const', const=True, help='apply a predictor before compressing, helps 16 bit and float output')
+	parser.add_argument('--output-tile-size', dest='outputTileSize', type=int, help='write whole images as tiles of this size instead of strips')
+	parser.add_argument('--no-metadata', dest='transferMetadata', action='store_false', help='do not copy GPS, capture time and camera tags into the outputs')
+	parser.add_argument('--statistics', nargs='?', const='csv', choices=OutputStatistics.FORMATS, help='write per-image and batch index statistics (range, mean, percentiles, histogram) to a csv (default) or parquet sidecar')
+	parser.add_argument('--timings', help='append per-image stage timings, bytes read and written and peak array size as JSON lines to this file')
+	parser.add_argument('--prometheus', help='keep running totals of the timings in this file in the Prometheus text format, e.g., for the node exporter textfile collector')
+	parser.add_argument('--no-resume', dest='resume', action='store_false', help='process every image even if the destination manifest says it is up to date')
+	arguments = parser.parse_args(theArguments)
+	if arguments.job == None and (arguments.source == None or arguments.destination == None):
+		parser.error('either SOURCE and DESTINATION or --job is required')
+	return arguments
+
+def loadJobs(theArguments):
+	if theArguments.job != None:
+		with open(theArguments.job, 'r') as file:
+			jobs = json.load(file)
+		if isinstance(jobs, dict):
+			jobs = jobs['jobs']
+		return jobs
+	job = vars(theArguments).copy()
+	for key in ('job', 'timings', 'prometheus'):
+		del job[key]
+	if job['statistics'] != None:
+		job['statisticsFormat'] = job['statistics']
+	job['statistics'] = job['statistics'] != None
+	#Options left unset fall back to the preset or the processor defaults
+	for key in ('products', 'preset', 'compression', 'compressionLevel', 'predictor', 'outputTileSize'):
+		if job[key] == None:
+			del job[key]
+	for key in ('scaleFrom', 'scaleTo'):
+		if job[key] == int(job[key]):
+			job[key] = int(job[key])
+	return [job]
+
+def defineIndex(theDefinition):
+	#NAME=EXPRESSION[:MIN:MAX]
+	name, expression = theDefinition.split('=', 1)
+	parts = expression.rsplit(':', 2)
+	if len(parts) == 3:
+		return registerIndex(name.strip(), parts[0], (float(parts[1]), float(parts[2])))
+	return registerIndex(name.strip(), expression)
+
+def runJob(theProcessor, theJob):
+	settings = dict(theJob)
+	source = settings.pop('source')
+	destination = settings.pop('destination')
+	if 'preset' in settings:
+		theProcessor.applyPreset(settings.pop('preset'))
+	for definition in settings.pop('defineIndex', None) or []:
+		try:
+			defineIndex(definition)
+		except (ValueError, SyntaxError) as error:
+			theProcessor.log('Unable to define index %s: %s' % (definition, error))
+			return False
+	calibration = settings.pop('calibration', None)
+	library = settings.pop('calibrationLibrary', None)
+	mode = settings.pop('calibrationMode', 'nearest')
+	theProcessor.radiometricCalibrator = None
+	theProcessor.radiometricCalibration = False
+	if library != None:
+		theProcessor.calibrationLibrary = CalibrationLibrary(mode)
+		for fileName in library:
+			try:
+				theProcessor.calibrationLibrary.addFile(fileName)
+			except (IOError, ValueError) as error:
+				theProcessor.log('Unable to add %s to the calibration library: %s' % (fileName, error))
+				return False
+		theProcessor.radiometricCalibration = True
+	if calibration != None:
+		try:
+			calibrator = RadiometricCalibrator.fromFile(calibration)
+		except (IOError, ValueError) as error:
+			theProcessor.log('Unable to load a calibration model from %s: %s' % (calibration, error))
+			return False
+		if calibrator.model == None:
+			theProcessor.log('Unable to load a calibration model from %s' % calibration)
+			return False
+		theProcessor.radiometricCalibrator = calibrator
+		theProcessor.radiometricCalibration = True
+	return theProcessor.process(source, destination, **settings) and len(theProcessor.failedFiles) == 0
+
+def main(theArguments=None):
+	arguments = parseArguments(theArguments)
+	jobs = loadJobs(arguments)
+	instrumentation = None
+	if arguments.timings != None or arguments.prometheus != None:
+		instrumentation = Instrumentation()
+		if arguments.timings != None:
+			instrumentation.addSink(JsonLinesSink(arguments.timings))
+		if arguments.prometheus != None:
+			instrumentation.addSink(PrometheusSink(arguments.prometheus))
+	succeeded = True
+	try:
+		for job in range(len(jobs)):
+			#Fresh processor per job so settings do not leak from one job into the next
+			processor = CommandLineProcessor()
+			processor.job = job
+			processor.instrumentation = instrumentation
+			if not runJob(processor, jobs[job]):
+				succeeded = False
+	finally:
+		if instrumentation != None:
+			instrumentation.close()
+	return 0 if succeeded else 1
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -16,110 +16,922 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
-import glob, re, os
+import glob, re, os, json, hashlib, itertools, collections, multiprocessing, threading, queue, concurrent.futures
 import numpy as np
-import cv2
 import pyexiv2
+import tifffile
 from tifffile import TiffWriter
+try:
+	#Needed by tifffile for LZW and zstd, and for the floating point predictor
+	import imagecodecs
+except ImportError:
+	imagecodecs = None
+
+from pmt.processing_manifest import ProcessingManifest
+from pmt.radiometric_calibrator import exifDateTime, pixelMaximum, readImageData
+from pmt.indicies import getIndex, registerIndex
+from pmt.palettes import getPalette, getTiffColormap, registerPalette
+from pmt.exif_transfer import extractMetadata, getTiffTags
+from pmt.output_statistics import IndexStatistics, OutputStatistics
+from pmt.instrumentation import ImageRecord
+
+#Error recorded for images skipped because the run was cancelled
+CANCELLED = 'Cancelled'
+
+#Processor instance owned by each worker process of the pool
+workerProcessor = None
+
+def initializeWorker(theSettings):
+	#Build the worker's processor once, settings and calibrator are shipped only at pool start up
+	global workerProcessor
+	settings = dict(theSettings)
+	#Indices registered at run time in the parent do not exist in a spawned worker
+	for name, definition in settings.pop('indexDefinitions', {}).items():
+		registerIndex(name, *definition)
+	for name, table in settings.pop('paletteDefinitions', {}).items():
+		registerPalette(name, table)
+	workerProcessor = CalibrationIndiciesProcessor()
+	workerProcessor.applySettings(settings)
+
+def processWorkerFile(theArguments):
+	file, destinationDir = theArguments
+	return workerProcessor.processFileSafely(file, destinationDir)
 
 class CalibrationIndiciesProcessor():
+	#Attributes shipped to worker processes, the calibrator is handled separately
+	SETTINGS = ['scaleFrom', 'scaleTo', 'fileExtension', 'radiometricCalibration', 'index', 'lut', 'lutMode', 'redBand', 'greenBand', 'blueBand', 'nirBand', 'products', 'fused', 'tileSize', 'bigTiff', 'compression', 'compressionLevel', 'predictor', 'outputTileSize', 'transferMetadata', 'statistics', 'recordTimings', 'reduction', 'calibrationLibrary']
+	#Attributes of the run as a whole, the parent process handles these
+	RUN_SETTINGS = ['workers', 'resume', 'hashContent', 'pipeline', 'readThreads', 'writeThreads', 'queueDepth', 'statisticsFormat', 'instrumentation']
+	#Output codecs and the tifffile compression they map to
+	COMPRESSIONS = {'none': None, 'deflate': 'zlib', 'lzw': 'lzw', 'zstd': 'zstd', 'lzma': 'lzma'}
+	#Named output settings, see benchmarks/compression_presets.py for their speed and size on typical frames
+	PRESETS = {
+		'none': {'compression': 'none', 'compressionLevel': None, 'predictor': False},
+		'fast': {'compression': 'deflate', 'compressionLevel': 1, 'predictor': True},
+		'balanced': {'compression': 'deflate', 'compressionLevel': 6, 'predictor': True},
+		'archive': {'compression': 'deflate', 'compressionLevel': 9, 'predictor': True}
+	}
+
 	def __init__(self, theCalibrator=None):
 		self.radiometricCalibrator = theCalibrator
+		#Optional CalibrationLibrary, when set each image is calibrated with the calibration closest to its capture time
+		self.calibrationLibrary = None
 		self.scaleFrom = 0
 		self.scaleTo = 255
 		self.fileExtension = 'JPG'
 		self.radiometricCalibration = False
+		#Index name, or several as a list or comma separated string, each written to its own output
 		self.index = 'None'
 		self.lut = 'None'
+		#Colormapped output as an indexed color TIFF ('palette'), a third the size, or as 'rgb'
+		self.lutMode = 'palette'
 		self.redBand = 1
+		self.greenBand = 2
+		self.blueBand = 3
 		self.nirBand = 3
+		#Outputs to write from each decode, e.g., [{'index': 'None', 'scaleTo': 1}, {'index': 'NDVI', 'lut': 'Jet'}], missing
+		#keys come from the settings above and 'name' is the prefix of the output file. Empty writes one output per index.
+		self.products = []
 		self.currentMin = 0
 		self.currentMax = 255
-	
-	def indexNdvi(self, theImage):
-		#Put each band into its own array
-		bands = np.split(theImage, 3, axis=2)
-		image = (bands[self.nirBand - 1] - bands[self.redBand - 1]) / (bands[self.nirBand - 1] + bands[self.redBand - 1])
-		self.currentMin = -1.0
-		self.currentMax = 1.0
-		return image
+		#Source files that failed in the last run
+		self.failedFiles = []
+		self.cancelled = False
+		self.fused = True
+		self.buffers = {}
+		#Tiled processing for frames too large for memory, 0 processes whole images
+		self.tileSize = 0
+		self.bigTiff = False
+		#Preview run, images are decoded at 1/2, 1/4 or 1/8 size and the output names get a -1of<reduction> suffix
+		self.reduction = 1
+		#Output codec, level (None for the codec's default) and whether to apply a predictor before compressing
+		self.compression = 'deflate'
+		self.compressionLevel = 6
+		self.predictor = False
+		#Tile size for images written whole, 0 writes strips. Tiled processing writes its processing tiles.
+		self.outputTileSize = 0
+		#Copy GPS, capture time and camera tags of the source image into the outputs
+		self.transferMetadata = True
+		#Write a sidecar of per-image and batch index statistics (OutputStatistics.FORMATS) to the destination
+		self.statistics = False
+		self.statisticsFormat = 'csv'
+		#Optional Instrumentation receiving an ImageRecord of stage timings per image, workers only need recordTimings
+		self.instrumentation = None
+		self.recordTimings = False
+		self.workers = 1
+		#Skip images the destination manifest records as up to date, optionally comparing content hashes
+		self.resume = True
+		self.hashContent = False
+		#Streaming pipeline, decoded and computed images waiting between stages are capped by queueDepth
+		self.pipeline = False
+		self.readThreads = 2
+		self.writeThreads = 2
+		self.queueDepth = 4
+
+	def applySettings(self, theSettings):
+		for key, value in theSettings.items():
+			setattr(self, key, value)
+
+	def applyPreset(self, theName):
+		if theName not in self.PRESETS:
+			raise KeyError('Unknown preset %s, expected one of %s' % (theName, ', '.join(self.PRESETS)))
+		self.applySettings(self.PRESETS[theName])
+
+	def cancel(self):
+		#Stop the current run once the images already being processed are finished
+		self.cancelled = True
+
+	def calibrateImage(self, theData, theCalibrator):
+		#Float copy of the image, calibrated to reflectance when there is a model
+		if self.fused:
+			#Single precision, in-place, in the processor's reusable buffers. Results match the float64 path to within
+			#float32 rounding, i.e., integer outputs may differ by one count where a value lands on a boundary.
+			data = self.getBuffer('image', theData.shape)
+			if self.isCalibrating(theCalibrator):
+				#Normalized with the bit depth of this image rather than that of the calibration image
+				theCalibrator.calibrate(theData, out=data, maxValue=pixelMaximum(theData))
+				return (data, True)
+			np.copyto(data, theData, casting='unsafe')
+			return (data, False)
+		data = theData.astype('float')
+		if self.isCalibrating(theCalibrator):
+			return (theCalibrator.calibrate(data, maxValue=pixelMaximum(theData)), True)
+		return (data, False)
+
+	def castImage(self, theData, theProduct, out=None):
+		#Set dtype, with out (e.g., a memory-mapped output from createOutputs()) the result is written into it instead of a new array
+		if out is not None:
+			return self.castImageInto(theData, theProduct, out)
+		data = theData
+		if theProduct['scaleTo'] == 1:
+			#Buffers are reused for the next image so float output has to be copied out of them
+			if data.dtype.name != 'float32' or self.isBuffer(data):
+				data = data.astype('float32')
+		elif theProduct['scaleTo'] > 255:
+			#unsigned int (I:16)
+			data = self.castInteger(data, 'uint16')
+		elif theProduct['index'] != 'None':
+			if theProduct['lut'] == 'None':
+				#bit image (L)
+				data = self.castInteger(data, 'uint8')
+			else:
+				#Paletted, the 8 bit values index a 256 entry color table
+				data = self.castInteger(data[:,:,0], 'uint8')
+				if theProduct['lutMode'] == 'rgb':
+					#Single gather from the cached table rather than evaluating the colormap per pixel
+					data = np.take(getPalette(theProduct['lut']), data, axis=0)
+		else:
+			#RGB (RGB)
+			data = self.castInteger(data, 'uint8')
+		return data
+
+	def castImageInto(self, theData, theProduct, theOut):
+		#Same values as castImage()
+		if self.isPaletted(theProduct, False):
+			codes = self.castInteger(theData[:,:,0], 'uint8', theOut if theProduct['lutMode'] != 'rgb' else None)
+			if theProduct['lutMode'] == 'rgb':
+				np.take(getPalette(theProduct['lut']), codes, axis=0, out=theOut)
+			return theOut
+		if theOut.dtype.kind == 'f':
+			np.copyto(theOut, theData, casting='unsafe')
+			return theOut
+		return self.castInteger(theData, theOut.dtype, theOut)
+
+	def castInteger(self, theData, theDtype, theOut=None):
+		#Clipped to the range of the integer dtype so out of range values saturate instead of wrapping, truncated like
+		#astype(). The conversion is done by clip itself, without a clipped float temporary.
+		limits = np.iinfo(theDtype)
+		if theOut is None:
+			theOut = np.empty(theData.shape, dtype=theDtype)
+		np.clip(theData, limits.min, limits.max, out=theOut, casting='unsafe')
+		return theOut
+
+	def computeImage(self, theData, theCalibrator=None, theProducts=None, theStatistics=None, theRecord=None, theTargets=None):
+		#List of (product, output). The image is calibrated once and each index computed once, however many products use it.
+		#Index values are added to the matching IndexStatistics of theStatistics before they are scaled.
+		#Products with an array in theTargets, by name, are cast straight into it.
+		calibrator = theCalibrator if theCalibrator != None else self.radiometricCalibrator
+		products = theProducts if theProducts != None else self.getProducts()
+		if theRecord != None:
+			start = theRecord.start()
+		data, calibrated = self.calibrateImage(theData, calibrator)
+		if theRecord != None:
+			theRecord.stop('calibrate', start)
+			theRecord.array(data)
+		sources = {'None': data}
+		#Indices are evaluated on reflectance, or when uncalibrated on the counts normalized to [0, 1] by the bit depth
+		reflectance = data if calibrated else None
+		uses = collections.Counter([product['index'] for product in products])
+		outputs = []
+		for product in products:
+			name = product['index']
+			uses[name] -= 1
+			if name == 'None':
+				minimum, maximum = (0.0, 1.0) if calibrated else (None, None)
+				if not calibrated and theData.dtype.name != 'uint8':
+					#Deeper images are scaled down from their full range rather than truncated
+					minimum, maximum = (0.0, float(pixelMaximum(theData)))
+			else:
+				index = getIndex(name)
+				minimum, maximum = (index.minimum, index.maximum)
+				if name not in sources:
+					if theRecord != None:
+						start = theRecord.start()
+					if reflectance is None:
+						reflectance = self.normalizeImage(data, pixelMaximum(theData), uses['None'] == 0)
+					#Pixels where the index is undefined are left out of the statistics
+					invalid = None
+					if theStatistics != None and name in theStatistics:
+						invalid = self.getBuffer('invalid', reflectance.shape[0:2], 'bool') if self.fused else np.empty(reflectance.shape[0:2], dtype='bool')
+					if self.fused:
+						#Into the processor's buffers, the temporaries of the expression are reused from image to image
+						sources[name] = index.evaluate(reflectance, self.getBandNumbers(), out=self.getBuffer('index-' + name, reflectance.shape[0:2], reflectance.dtype), buffers=self.getBuffer, invalid=invalid)
+					else:
+						sources[name] = index.evaluate(reflectance, self.getBandNumbers(), invalid=invalid)
+					if theRecord != None:
+						theRecord.stop('index', start)
+					if invalid is not None:
+						theStatistics[name].add(sources[name], invalid)
+			image = sources[name]
+			if theRecord != None:
+				start = theRecord.start()
+			if minimum != None:
+				#Scaling is in place when fused, so work on a copy while later products still need the source
+				if self.fused and (uses[name] > 0 or (np.may_share_memory(image, data) and sum(uses.values()) > 0)):
+					image = image.copy()
+				image = self.scaleImage(image, minimum, maximum, product)
+			if theRecord != None:
+				theRecord.stop('scale', start)
+				start = theRecord.start()
+			outputs.append((product, self.castImage(image, product, out=theTargets[product['name']] if theTargets != None else None)))
+			if theRecord != None:
+				theRecord.stop('cast', start)
+				theRecord.array(outputs[-1][1])
+		return outputs
+
+	def computeOutputs(self, theFile, theData, theExif, theDestinationDir, theCalibrator=None, theStatistics=None, theRecord=None):
+		#computeImage() into memory-mapped output files when they can be, otherwise into arrays for writeImage()
+		targets = self.createOutputs(theFile, theData.shape[0:2], theExif, theDestinationDir, theCalibrator, theRecord)
+		try:
+			return self.computeImage(theData, theCalibrator, theStatistics=theStatistics, theRecord=theRecord, theTargets=targets)
+		except BaseException:
+			self.discardOutputs(targets)
+			raise
+
+	def computeTiles(self, theData, theCalibrator=None, theProduct=None, theStatistics=None, theRecord=None):
+		#Computed tiles of one output in row-major order, edge tiles are padded to the full tile size as TIFF requires
+		size = self.getTileSize()
+		for top in range(0, theData.shape[0], size):
+			for left in range(0, theData.shape[1], size):
+				tile = self.computeImage(np.ascontiguousarray(theData[top:top+size, left:left+size]), theCalibrator, [theProduct or self.getProducts()[0]], theStatistics, theRecord)[0][1]
+				if tile.shape[0] != size or tile.shape[1] != size:
+					padded = np.zeros((size, size) + tile.shape[2:], dtype=tile.dtype)
+					padded[0:tile.shape[0], 0:tile.shape[1]] = tile
+					tile = padded
+				yield tile
+
+	def copy(self):
+		#Processor with the same settings and a plain copy of the calibrator, e.g., to run a batch while this one is edited
+		processor = CalibrationIndiciesProcessor()
+		settings = self.getSettings()
+		del settings['indexDefinitions'], settings['paletteDefinitions']
+		settings['products'] = [dict(product) for product in self.products]
+		for key in self.RUN_SETTINGS:
+			settings[key] = getattr(self, key)
+		processor.applySettings(settings)
+		return processor
+
+	def createOutputs(self, theFile, theShape, theExif, theDestinationDir, theCalibrator=None, theRecord=None):
+		#Pre-allocated output files memory-mapped by product name, None when the outputs are not written uncompressed in strips
+		if not self.isMapped():
+			return None
+		if theRecord != None:
+			start = theRecord.start()
+		extratags = []
+		if self.transferMetadata:
+			extratags = getTiffTags(extractMetadata(theExif))
+		targets = {}
+		try:
+			for product in self.getProducts():
+				shape, dtype = self.getOutputFormat(product, theShape)
+				colormap = None
+				if self.isPaletted(product):
+					colormap = getTiffColormap(product['lut'])
+				photometric = 'palette' if colormap is not None else None
+				targets[product['name']] = tifffile.memmap(theDestinationDir+'/'+self.outputName(theFile, product), shape=shape, dtype=dtype, bigtiff=self.bigTiff, description=self.getDescription(theFile, product, theCalibrator), metadata=None, photometric=photometric, colormap=colormap, extratags=extratags)
+		except BaseException:
+			self.discardOutputs(targets)
+			raise
+		if theRecord != None:
+			theRecord.stop('write', start)
+		return targets
+
+	def createRecord(self, theFile):
+		#ImageRecord for the stage timings of theFile, None when nobody is listening
+		if self.recordTimings or self.instrumentation != None:
+			return ImageRecord(theFile)
+		return None
+
+	def createStatistics(self):
+		#Empty IndexStatistics for each index of the products, None when statistics are off
+		if not self.statistics:
+			return None
+		statistics = {}
+		for product in self.getProducts():
+			if product['index'] != 'None' and product['index'] not in statistics:
+				index = getIndex(product['index'])
+				statistics[product['index']] = IndexStatistics(index.minimum, index.maximum)
+		return statistics
+
+	def discardOutputs(self, theTargets):
+		#Remove the outputs of an image that failed part way, memory-mapped outputs or the names of the files written
+		if theTargets == None:
+			return
+		fileNames = [target if isinstance(target, str) else target.filename for target in theTargets.values()]
+		theTargets.clear()
+		for fileName in fileNames:
+			if os.path.exists(fileName):
+				os.remove(fileName)
+
+	def errorMessage(self, theError):
+		return str(theError) or theError.__class__.__name__
+
+	def getBandNumbers(self):
+		return {'red': self.redBand, 'green': self.greenBand, 'blue': self.blueBand, 'nir': self.nirBand}
+
+	def getDescription(self, theFile, theProduct, theCalibrator=None):
+		#Record how the output was produced, including the calibration model it came from, None when it was not calibrated
+		modelHash = self.getModelHash(theCalibrator) if theCalibrator != None else None
+		return json.dumps({'source': os.path.basename(theFile), 'index': theProduct['index'], 'scale': [theProduct['scaleFrom'], theProduct['scaleTo']], 'calibrationModel': modelHash})
+
+	def getIndicies(self):
+		indicies = self.index
+		if isinstance(indicies, str):
+			indicies = [name.strip() for name in indicies.split(',')]
+		#'None' is the image itself, so 'None,NDVI' writes both the (calibrated) image and NDVI
+		indicies = [name for name in indicies if name != '']
+		if len(indicies) == 0:
+			return ['None']
+		return indicies
+
+	def getProducts(self):
+		if len(self.products) == 0:
+			products = [{'index': index} for index in self.getIndicies()]
+		else:
+			products = [dict(product) for product in self.products]
+		for product in products:
+			product.setdefault('index', 'None')
+			for key in ('scaleFrom', 'scaleTo', 'lut', 'lutMode'):
+				product.setdefault(key, getattr(self, key))
+			product.setdefault('name', product['index'] if product['index'] != 'None' else '')
+		return products
+
+	def getSettings(self):
+		settings = {}
+		for key in self.SETTINGS:
+			settings[key] = getattr(self, key)
+		settings['indexDefinitions'] = {}
+		for name in set([product['index'] for product in self.getProducts()]):
+			if name != 'None':
+				index = getIndex(name)
+				settings['indexDefinitions'][name] = (index.expression, (index.minimum, index.maximum), index.description)
+		settings['paletteDefinitions'] = {}
+		for product in self.getProducts():
+			if self.isPaletted(product, False):
+				settings['paletteDefinitions'][product['lut']] = getPalette(product['lut'])
+		#Ship a plain copy of the calibrator so subclasses with unpicklable state (e.g., Qt) can still be used
+		settings['radiometricCalibrator'] = None
+		if self.radiometricCalibrator != None:
+			settings['radiometricCalibrator'] = self.radiometricCalibrator.copy()
+		return settings
+
+	def getBuffer(self, theName, theShape, theDtype='float32'):
+		#Scratch buffers are kept between images and only grow, smaller images get a view of the front of the buffer
+		size = int(np.prod(theShape))
+		buffer = self.buffers.get(theName)
+		if buffer is None or buffer.size < size or buffer.dtype != np.dtype(theDtype):
+			buffer = np.empty(size, dtype=theDtype)
+			self.buffers[theName] = buffer
+		return buffer[:size].reshape(theShape)
+
+	def getTileSize(self, theSize=None):
+		#TIFF tiles have to be a multiple of 16 pixels, theSize defaults to the processing tile size
+		size = theSize if theSize != None else self.tileSize
+		return max(16, ((size + 15) // 16) * 16)
+
+	def getWriteOptions(self, theDtype):
+		#tifffile.TiffWriter.save() arguments for the output codec
+		compression = self.COMPRESSIONS[self.compression]
+		if compression != None and self.compressionLevel != None and compression != 'lzw':
+			compression = (compression, self.compressionLevel)
+		options = {'compression': compression}
+		if self.predictor and compression != None:
+			#Horizontal differencing for integers, the floating point predictor needs imagecodecs
+			if np.dtype(theDtype).kind != 'f' or imagecodecs != None:
+				options['predictor'] = True
+		return options
+
+	def getCalibrator(self, theExif=None):
+		#Calibrator for an image, from the calibration library by capture time when there is one. radiometricCalibrator is
+		#the fallback for images the library cannot place, without one such an image fails rather than going out uncalibrated.
+		if self.radiometricCalibration and self.calibrationLibrary != None and len(self.calibrationLibrary) > 0:
+			calibrator = None
+			if theExif != None:
+				calibrator = self.calibrationLibrary.getCalibrator(exifDateTime(theExif))
+			if calibrator != None:
+				return calibrator
+			if not self.isCalibrating():
+				raise ValueError('No capture time to choose a calibration from the library and no fallback calibration')
+		return self.radiometricCalibrator
+
+	def getModelHash(self, theCalibrator=None):
+		#Hash of the model an image was calibrated with, or without one the models the whole run can use
+		if theCalibrator != None:
+			return theCalibrator.getModelHash() if self.isCalibrating(theCalibrator) else None
+		modelHash = None
+		if self.isCalibrating():
+			modelHash = self.radiometricCalibrator.getModelHash()
+		if self.radiometricCalibration and self.calibrationLibrary != None and len(self.calibrationLibrary) > 0:
+			modelHash = hashlib.sha1(json.dumps([self.calibrationLibrary.getHash(), modelHash]).encode('utf-8')).hexdigest()
+		return modelHash
+
+	def getOutputFormat(self, theProduct, theShape):
+		#Shape and dtype castImage() produces for theProduct from an image of theShape (rows, columns)
+		bands = 3 if theProduct['index'] == 'None' else 1
+		if theProduct['scaleTo'] == 1:
+			return (tuple(theShape) + (bands,), np.dtype('float32'))
+		if theProduct['scaleTo'] > 255:
+			return (tuple(theShape) + (bands,), np.dtype('uint16'))
+		if self.isPaletted(theProduct, False):
+			if theProduct['lutMode'] == 'rgb':
+				return (tuple(theShape) + (3,), np.dtype('uint8'))
+			return (tuple(theShape), np.dtype('uint8'))
+		return (tuple(theShape) + (bands,), np.dtype('uint8'))
+
+	def getParametersHash(self):
+		#Everything that changes the content of the outputs
+		products = self.getProducts()
+		indicies = [(name, getIndex(name).expression, getIndex(name).minimum, getIndex(name).maximum) for name in sorted(set([product['index'] for product in products])) if name != 'None']
+		palettes = dict([(product['lut'], getPalette(product['lut']).tolist()) for product in products if self.isPaletted(product, False)])
+		parameters = {'products': products, 'definitions': indicies, 'palettes': palettes, 'bands': self.getBandNumbers(), 'fused': self.fused, 'reduction': self.reduction, 'calibration': self.getModelHash()}
+		return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+	def isCalibrating(self, theCalibrator=None):
+		calibrator = theCalibrator if theCalibrator != None else self.radiometricCalibrator
+		return self.radiometricCalibration and calibrator != None and calibrator.model != None
+
+	def isBuffer(self, theData):
+		for buffer in self.buffers.values():
+			if np.may_share_memory(theData, buffer):
+				return True
+		return False
+
+	def isMapped(self):
+		#tifffile can only memory-map contiguous, uncompressed image data, i.e., whole images written in strips
+		return self.COMPRESSIONS[self.compression] == None and self.outputTileSize <= 0 and self.tileSize <= 0
+
+	def isPaletted(self, theProduct, theIndexed=True):
+		#Whether the product is colormapped, and with theIndexed, written as an indexed color TIFF
+		if theProduct['index'] == 'None' or theProduct['lut'] == 'None' or theProduct['scaleTo'] == 1 or theProduct['scaleTo'] > 255:
+			return False
+		return theProduct['lutMode'] == 'palette' or not theIndexed
 
 	def log(self, theMessage, **kwargs):
 		pass
 
+	def normalizeImage(self, theData, theMaximum, theInPlace=False):
+		#theData divided by the white level, in place when nothing needs the counts any more
+		if theMaximum == 1.0:
+			return theData
+		out = None
+		if theInPlace:
+			out = theData
+		elif self.fused:
+			out = self.getBuffer('normalized', theData.shape, theData.dtype)
+		return np.multiply(theData, 1.0 / theMaximum, out=out)
+
+	def outputName(self, theFile, theProduct=None):
+		path, baseName = os.path.split(theFile)
+		suffix = '-1of' + str(self.reduction) if self.reduction != 1 else ''
+		baseName = re.sub(r'\.'+re.escape(self.fileExtension)+'$', suffix+'.tiff', baseName)
+		product = theProduct if theProduct != None else self.getProducts()[0]
+		if product['name'] != '':
+			baseName = product['name']+'-'+baseName
+		return baseName
+
 	def process(self, theSourceDir, theDestinationDir, **kwargs):
-		for key, value in kwargs.items():
-			setattr(self, key, value)
+		self.applySettings(kwargs)
+		self.cancelled = False
 
 		if theSourceDir == theDestinationDir:
 			self.log("Input and output directories cannot be the same.")
 			return False
-		fileList = glob.glob(theSourceDir+'/*.'+self.fileExtension)
+		#Sort so runs, and the output they log, are deterministic
+		fileList = sorted(glob.glob(theSourceDir+'/*.'+self.fileExtension))
 		if len(fileList) == 0:
 			self.log(" Zero files to process in source directory.")
 			return False
+		if self.reduction not in (1, 2, 4, 8):
+			self.log("Unsupported reduction %s, expected 1, 2, 4 or 8." % self.reduction)
+			return False
+		if self.compression not in self.COMPRESSIONS:
+			self.log("Unknown compression %s, expected one of %s." % (self.compression, ', '.join(self.COMPRESSIONS)))
+			return False
+		if self.compression in ('lzw', 'zstd') and imagecodecs == None:
+			self.log("%s compression requires the imagecodecs package." % self.compression)
+			return False
+		products = self.getProducts()
+		names = [product['name'] for product in products]
+		if len(set(names)) != len(names):
+			self.log("Each product needs its own name, %s." % ', '.join(["'"+name+"'" for name in names]))
+			return False
+		for product in products:
+			if product['index'] != 'None':
+				try:
+					getIndex(product['index'])
+				except KeyError as error:
+					self.log("%s." % error.args[0])
+					return False
+			if self.isPaletted(product, False):
+				try:
+					getPalette(product['lut'])
+				except KeyError as error:
+					self.log("%s." % error.args[0])
+					return False
+		if not os.path.isdir(theDestinationDir):
+			os.makedirs(theDestinationDir)
 
-		fileList = glob.glob(theSourceDir+'/*.'+self.fileExtension)
-		self.log('Processing %i images' % len(fileList))
+		self.failedFiles = []
 		progress = 0
-		for file in fileList:
-			#Load image
-			data = cv2.cvtColor(cv2.imread(file), cv2.COLOR_BGR2RGB)
-			data = data.astype('float')
-			self.currentMax = 0
-
-			#Load original EXIF data
-			inExif = pyexiv2.metadata.ImageMetadata(file)
-			inExif.read()
-			
-			#Radiometric Calibration
-			if self.radiometricCalibrator != None and self.radiometricCalibration:
-				data = self.radiometricCalibrator.calibrate(data)
-				self.currentMax = 1
-
-			#compute index
-			if self.index == 'NDVI':
-				data = self.indexNdvi(data)
-
-			#Scale
-			if self.currentMax != 0:
-				percentOfRange = (data - self.currentMin) / (self.currentMax - self.currentMin)
-				data = (self.scaleFrom * (1 - percentOfRange)) + (self.scaleTo * percentOfRange)
-			
-			#Set dtype
-			if self.scaleTo == 1:
-				if data.dtype.name != 'float32':
-					data = data.astype('float32')
-			elif self.scaleTo > 255:
-				#unsigned int (I:16)
-				data = data.astype('uint16')
-			elif self.index != 'None':
-				if self.lut == 'None':
-					#bit image (L)
-					data = data.astype('uint8')
-					pass
+		manifest = None
+		if self.resume:
+			manifest = ProcessingManifest(theDestinationDir)
+			parameters = self.getParametersHash()
+			fingerprints = {}
+			pending = []
+			for file in fileList:
+				fingerprints[file] = manifest.fingerprint(file, self.hashContent)
+				if not manifest.isCurrent(file, fingerprints[file], parameters):
+					pending.append(file)
+			progress = len(fileList) - len(pending)
+			if progress > 0:
+				self.log('Skipping %i images that are up to date' % progress, progress=progress)
+			fileList = pending
+			if len(fileList) == 0:
+				return True
+
+		statistics = None
+		if self.statistics:
+			try:
+				statistics = OutputStatistics(theDestinationDir, self.statisticsFormat)
+			except (ValueError, ImportError) as error:
+				self.log("Unable to write statistics: %s." % error)
+				return False
+
+		self.recordTimings = self.instrumentation != None
+		self.log('Processing %i images' % len(fileList))
+		if self.workers > 1 and len(fileList) > 1:
+			results = self.processParallel(fileList, theDestinationDir)
+		elif self.pipeline and self.tileSize <= 0:
+			#Tiled runs are not pipelined, prefetching whole frames would defeat the memory bound
+			results = self.processPipelined(fileList, theDestinationDir)
+		else:
+			results = (self.processFileSafely(file, theDestinationDir) for file in fileList if not self.cancelled)
+
+		try:
+			for file, baseNames, error, imageStatistics, record in results:
+				if error == CANCELLED:
+					continue
+				if self.instrumentation != None and record != None:
+					self.instrumentation.emit(record)
+				#Log and progress
+				progress += 1
+				if error == None:
+					self.log('%s created' % (', '.join(baseNames)), progress=progress)
+					if statistics != None:
+						statistics.record(file, imageStatistics)
 				else:
-					#Paletted
+					self.failedFiles.append(file)
+					self.log('Failed to process %s: %s' % (os.path.basename(file), error), progress=progress)
+				if manifest != None:
+					if error == None:
+						manifest.record(file, fingerprints[file], parameters, baseNames, self.getModelHash())
+					else:
+						manifest.remove(file, [self.outputName(file, product) for product in self.getProducts()])
+					#Checkpoint regularly so an interrupted run loses little
+					if progress % 50 == 0:
+						manifest.save()
+		finally:
+			if manifest != None:
+				manifest.save()
+			if statistics != None:
+				statistics.close()
+			if self.instrumentation != None:
+				self.instrumentation.flush()
+		if self.cancelled:
+			self.log('Processing cancelled')
+			return False
+		return True
+
+	def processFile(self, theFile, theDestinationDir, theRecord=None):
+		#Names of the outputs written and the image's index statistics
+		data, inExif = self.readImage(theFile, theRecord)
+		calibrator = self.getCalibrator(inExif)
+		statistics = self.createStatistics()
+		if self.tileSize > 0:
+			#Tiles are streamed to one file at a time, so each output computes its own tiles, statistics are taken from the first output of each index
+			outputs = []
+			for product in self.getProducts():
+				counted = [output[0]['index'] for output in outputs]
+				outputs.append((product, self.computeTiles(data, calibrator, product, statistics if product['index'] not in counted else None, theRecord)))
+			return (self.writeImage(theFile, outputs, inExif, theDestinationDir, shape=data.shape[0:2], calibrator=calibrator, record=theRecord), statistics)
+		outputs = self.computeOutputs(theFile, data, inExif, theDestinationDir, calibrator, statistics, theRecord)
+		return (self.writeImage(theFile, outputs, inExif, theDestinationDir, calibrator=calibrator, record=theRecord), statistics)
+
+	def processFileSafely(self, theFile, theDestinationDir):
+		#A failing file is reported back rather than aborting the whole batch
+		#Results are (file, output names, error, statistics, ImageRecord or None)
+		record = self.createRecord(theFile)
+		try:
+			baseNames, statistics = self.processFile(theFile, theDestinationDir, record)
+			error = None
+		except Exception as exception:
+			baseNames, statistics = (None, None)
+			error = self.errorMessage(exception)
+		if record != None:
+			record.finish(error)
+		return (theFile, baseNames, error, statistics, record)
+
+	def processParallel(self, theFileList, theDestinationDir):
+		#Spawned rather than forked workers, forking a process that is running threads (e.g., Qt) is not safe
+		workers = min(self.workers, len(theFileList))
+		context = multiprocessing.get_context('spawn')
+		settings = self.getSettings()
+		executor = None
+		try:
+			#Files are handed out a few at a time so a cancel takes effect between images
+			files = iter(theFileList)
+			inFlight = {}
+			#Images that were in flight when a worker died, each is run again on its own to find the one that kills it
+			suspects = collections.deque()
+			isolated = set()
+			while True:
+				if executor == None:
+					executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=initializeWorker, initargs=(settings,))
+				if len(suspects) > 0:
+					if len(inFlight) == 0 and not self.cancelled:
+						file = suspects.popleft()
+						isolated.add(file)
+						inFlight[executor.submit(processWorkerFile, (file, theDestinationDir))] = file
+				else:
+					while len(inFlight) < workers * 2 and not self.cancelled:
+						file = next(files, None)
+						if file == None:
+							break
+						inFlight[executor.submit(processWorkerFile, (file, theDestinationDir))] = file
+				if len(inFlight) == 0:
+					break
+				done, running = concurrent.futures.wait(inFlight, return_when=concurrent.futures.FIRST_COMPLETED)
+				if any(isinstance(future.exception(), concurrent.futures.BrokenExecutor) for future in done):
+					#A worker died, e.g., killed or crashed in a decoder, and took the pool with it. Every image in flight
+					#finishes with its result or the breakage, the rest of the batch goes to a new pool.
+					done, running = concurrent.futures.wait(inFlight)
+					executor.shutdown(wait=False)
+					executor = None
+				for future in done:
+					file = inFlight.pop(future)
+					try:
+						yield future.result()
+					except concurrent.futures.BrokenExecutor:
+						if file in isolated:
+							yield (file, None, 'Worker process terminated abruptly', None, None)
+						else:
+							suspects.append(file)
+					except Exception as error:
+						yield (file, None, self.errorMessage(error), None, None)
+		finally:
+			if executor != None:
+				executor.shutdown(wait=True, cancel_futures=True)
+
+	def processPipelined(self, theFileList, theDestinationDir):
+		#Decode, compute and encode run as concurrent stages; cv2 and zlib release the GIL so I/O overlaps the math
+		#Items are (file, payload, error) tuples, a failure is passed along to the end so every file is reported
+		#Results are as from processFileSafely()
+		fileQueue = queue.Queue()
+		for file in theFileList:
+			fileQueue.put(file)
+		decodedQueue = queue.Queue(max(1, self.queueDepth))
+		computedQueue = queue.Queue(max(1, self.queueDepth))
+		doneQueue = queue.Queue()
+		writeThreads = max(1, self.writeThreads)
+		records = {}
+		#Set when the consumer stops taking results, the stages then give up waiting on each other and exit
+		stopped = threading.Event()
+
+		def get(theQueue):
+			while not stopped.is_set():
+				try:
+					return theQueue.get(timeout=0.1)
+				except queue.Empty:
 					pass
-			else:
-				#RGB (RGB)
-				data = data.astype('uint8')
-
-			#Save processed data to new file
-			path, baseName = os.path.split(file)
-			baseName = re.sub(r''+re.escape(self.fileExtension)+'$', 'tiff', baseName)
-			if self.index != 'None':
-				baseName = self.index+'-'+baseName
-			tif = TiffWriter(theDestinationDir+'/'+baseName)
-			tif.save(data, compress=6)
-			tif = None
-			
-			#Transfer EXIF data to new file
-			outExif = pyexiv2.metadata.ImageMetadata(theDestinationDir+'/'+baseName)
-			outExif.read()
-			#inExif.copy(outExif, comment=False)
-			#outExif.write()
-
-			#Log and progress
-			progress += 1
-			self.log('%s created' % (baseName), progress=progress)
\ No newline at end of file
+			return None
+
+		def put(theQueue, theItem):
+			while not stopped.is_set():
+				try:
+					theQueue.put(theItem, timeout=0.1)
+					return True
+				except queue.Full:
+					pass
+			return False
+
+		def read():
+			while not stopped.is_set():
+				try:
+					file = fileQueue.get_nowait()
+				except queue.Empty:
+					return
+				if self.cancelled:
+					if not put(decodedQueue, (file, None, CANCELLED)):
+						return
+					continue
+				#Records are looked up by file in each stage, so a failure at any stage still finishes its record
+				records[file] = self.createRecord(file)
+				try:
+					item = (file, self.readImage(file, records[file]), None)
+				except Exception as error:
+					item = (file, None, self.errorMessage(error))
+				if not put(decodedQueue, item):
+					return
+
+		def compute():
+			for count in range(len(theFileList)):
+				item = get(decodedQueue)
+				if item == None:
+					return
+				file, image, error = item
+				if error == None and self.cancelled:
+					#Frames decoded before the cancel are dropped rather than computed and written
+					image, error = None, CANCELLED
+				if error == None:
+					try:
+						calibrator = self.getCalibrator(image[1])
+						statistics = self.createStatistics()
+						image = (self.computeOutputs(file, image[0], image[1], theDestinationDir, calibrator, statistics, records[file]), image[1], calibrator, statistics)
+					except Exception as exception:
+						image, error = None, self.errorMessage(exception)
+				if not put(computedQueue, (file, image, error)):
+					return
+			for count in range(writeThreads):
+				put(computedQueue, None)
+
+		def write():
+			while True:
+				item = get(computedQueue)
+				if item == None:
+					return
+				file, image, error = item
+				baseNames = None
+				statistics = None
+				record = records.pop(file, None)
+				if error == None:
+					try:
+						baseNames = self.writeImage(file, image[0], image[1], theDestinationDir, calibrator=image[2], record=record)
+						statistics = image[3]
+					except Exception as exception:
+						error = self.errorMessage(exception)
+				if record != None:
+					record.finish(error)
+				doneQueue.put((file, baseNames, error, statistics, record))
+
+		threads = [threading.Thread(target=read) for count in range(max(1, self.readThreads))]
+		threads.append(threading.Thread(target=compute))
+		threads += [threading.Thread(target=write) for count in range(writeThreads)]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		try:
+			for count in range(len(theFileList)):
+				yield doneQueue.get()
+		finally:
+			stopped.set()
+			for thread in threads:
+				thread.join()
+
+	def readImage(self, theFile, theRecord=None):
+		#Load image
+		if theRecord != None:
+			start = theRecord.start()
+			theRecord.bytesRead += os.path.getsize(theFile)
+		extension = os.path.splitext(theFile)[1].lower()
+		if self.tileSize > 0 and extension in ('.tif', '.tiff') and self.reduction == 1:
+			data = self.readTiffMapped(theFile)
+		else:
+			#Native bit depth, 16 bit TIFF and PNG are not truncated and RAW files are read as linear 16 bit.
+			#Tiles are copied out one at a time anyway, so skip the full size colour conversion copy.
+			data = readImageData(theFile, theContiguous=self.tileSize <= 0, theReduction=self.reduction)
+		if theRecord != None:
+			theRecord.stop('read', start)
+			theRecord.array(data)
+			start = theRecord.start()
+
+		#Load original EXIF data
+		inExif = pyexiv2.metadata.ImageMetadata(theFile)
+		inExif.read()
+		if theRecord != None:
+			theRecord.stop('exif', start)
+		return (data, inExif)
+
+	def readTiffMapped(self, theFile):
+		#Map uncompressed TIFFs directly, anything else is decoded into a temporary memory-mapped file. The bands are
+		#those readImageData() gives, RGB from gray or RGBA as views, and what tifffile cannot map or decode, e.g., LZW
+		#without imagecodecs, or another layout is read by readImageData() instead.
+		try:
+			try:
+				data = tifffile.memmap(theFile, mode='r')
+			except ValueError:
+				data = tifffile.imread(theFile, out='memmap')
+		except Exception:
+			return readImageData(theFile, theContiguous=False)
+		if data.dtype.name not in ('uint8', 'uint16', 'float32'):
+			return readImageData(theFile, theContiguous=False)
+		if data.ndim == 2:
+			return np.broadcast_to(data[:,:,np.newaxis], data.shape + (3,))
+		if data.ndim == 3 and data.shape[2] in (3, 4):
+			return data[:,:,0:3]
+		return readImageData(theFile, theContiguous=False)
+
+	def scaleImage(self, theData, theMinimum, theMaximum, theProduct):
+		#Linear map of [theMinimum, theMaximum] onto the product's [scaleFrom, scaleTo]
+		self.currentMin = theMinimum
+		self.currentMax = theMaximum
+		scaleFrom = theProduct['scaleFrom']
+		scaleTo = theProduct['scaleTo']
+		if not self.fused:
+			percentOfRange = (theData - theMinimum) / (theMaximum - theMinimum)
+			return (scaleFrom * (1 - percentOfRange)) + (scaleTo * percentOfRange)
+		np.subtract(theData, theMinimum, out=theData)
+		np.multiply(theData, (scaleTo - scaleFrom) / (theMaximum - theMinimum), out=theData)
+		np.add(theData, scaleFrom, out=theData)
+		return theData
+
+	def writeImage(self, theFile, theOutputs, theExif, theDestinationDir, shape=None, calibrator=None, record=None):
+		#Save each (product, data) output to a new file, data is either an array or, with the image shape, an iterator of tiles from computeTiles()
+		baseNames = []
+		#Metadata comes from the EXIF already read with the image and is written with the TIFF, the output is not reopened
+		extratags = []
+		if record != None:
+			start = record.start()
+		if self.transferMetadata and not self.isMapped():
+			extratags = getTiffTags(extractMetadata(theExif))
+		if record != None:
+			record.stop('exif', start)
+		#Every output of the image is removed when one fails, e.g., a tiled read failing part way
+		targets = {}
+		try:
+			for product, data in theOutputs:
+				if record != None:
+					#Tiles are computed while they are written, that time is already counted by the compute stages
+					start = record.start()
+					computed = record.computeSeconds()
+				baseName = self.outputName(theFile, product)
+				targets[product['name']] = theDestinationDir+'/'+baseName
+				if isinstance(data, np.memmap):
+					#Already in its file with all tags. Not flushed, msync would wait for the disk where write() does not, the
+					#dirty pages are written back by the OS like any other buffered write.
+					if record != None:
+						record.stop('write', start)
+						record.bytesWritten += os.path.getsize(theDestinationDir+'/'+baseName)
+					baseNames.append(baseName)
+					continue
+				description = self.getDescription(theFile, product, calibrator)
+				colormap = None
+				if self.isPaletted(product):
+					colormap = getTiffColormap(product['lut'])
+				tif = TiffWriter(theDestinationDir+'/'+baseName, bigtiff=self.bigTiff)
+				try:
+					if isinstance(data, np.ndarray):
+						photometric = 'palette' if colormap is not None else None
+						tile = None
+						if self.outputTileSize > 0:
+							size = self.getTileSize(self.outputTileSize)
+							tile = (size, size)
+						tif.save(data, description=description, metadata=None, photometric=photometric, colormap=colormap, tile=tile, extratags=extratags, **self.getWriteOptions(data.dtype))
+					else:
+						#Write the tiles as they are computed, the shape and dtype come from the first tile
+						first = next(data)
+						if colormap is not None:
+							photometric = 'palette'
+						else:
+							photometric = 'rgb' if len(first.shape) == 3 and first.shape[2] == 3 else 'minisblack'
+						tif.save(itertools.chain([first], data), shape=tuple(shape) + first.shape[2:], dtype=first.dtype, tile=first.shape[0:2], photometric=photometric, colormap=colormap, description=description, metadata=None, extratags=extratags, **self.getWriteOptions(first.dtype))
+				finally:
+					tif.close()
+				if record != None:
+					record.stop('write', start, record.computeSeconds() - computed)
+					record.bytesWritten += os.path.getsize(theDestinationDir+'/'+baseName)
+				baseNames.append(baseName)
+		except BaseException:
+			self.discardOutputs(targets)
+			raise
+		return baseNames
@@ -0,0 +1,103 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import bisect, collections, hashlib, json
+
+from pmt.radiometric_calibrator import RadiometricCalibrator
+
+class CalibrationLibrary():
+	#Calibrations from target shots taken through a flight, indexed by capture time. Each image is calibrated with the
+	#nearest calibration, or with a model interpolated between the two calibrations taken before and after it.
+	MODES = ['nearest', 'interpolate']
+	#Interpolation weights are rounded to this many steps so blended calibrators (and their lookup tables) can be reused
+	WEIGHT_STEPS = 100
+	CACHE_SIZE = 64
+
+	def __init__(self, theMode='nearest'):
+		self.mode = theMode
+		self.times = []
+		self.calibrators = []
+		self.cache = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self.calibrators)
+
+	def add(self, theCalibrator):
+		#Fitted calibrators are kept without their image, sorted by capture time
+		if theCalibrator.model == None:
+			raise ValueError('Calibration %s has no model' % theCalibrator.fileName)
+		if theCalibrator.dateTime == None:
+			raise ValueError('Calibration %s has no capture time' % theCalibrator.fileName)
+		timestamp = theCalibrator.dateTime.timestamp()
+		position = bisect.bisect_right(self.times, timestamp)
+		self.times.insert(position, timestamp)
+		self.calibrators.insert(position, theCalibrator.copy())
+		self.cache.clear()
+
+	def addFile(self, theFileName):
+		#Calibration image with saved ROIs or a model file written by RadiometricCalibrator.saveModel()
+		self.add(RadiometricCalibrator.fromFile(theFileName))
+
+	def blend(self, theFirst, theSecond, theWeight):
+		#Linear interpolation of the fitted models, only meaningful when both were fitted with the same preprocessing
+		calibrator = theFirst.copy()
+		for band in range(3):
+			for key in ('slope', 'intercept'):
+				calibrator.model[band][key] = ((1.0 - theWeight) * theFirst.model[band][key]) + (theWeight * theSecond.model[band][key])
+		return calibrator
+
+	def getCalibrator(self, theDateTime):
+		if len(self.calibrators) == 0 or theDateTime == None:
+			return None
+		timestamp = theDateTime.timestamp()
+		position = bisect.bisect_left(self.times, timestamp)
+		if position == 0:
+			return self.calibrators[0]
+		if position == len(self.times):
+			return self.calibrators[-1]
+		before = position - 1
+		span = self.times[position] - self.times[before]
+		weight = 0.0 if span == 0 else (timestamp - self.times[before]) / span
+		if self.mode != 'interpolate' or not self.isCompatible(self.calibrators[before], self.calibrators[position]):
+			return self.calibrators[position] if weight > 0.5 else self.calibrators[before]
+
+		step = int(round(weight * self.WEIGHT_STEPS))
+		if step == 0:
+			return self.calibrators[before]
+		if step == self.WEIGHT_STEPS:
+			return self.calibrators[position]
+		key = (before, step)
+		if key in self.cache:
+			self.cache.move_to_end(key)
+		else:
+			self.cache[key] = self.blend(self.calibrators[before], self.calibrators[position], step / self.WEIGHT_STEPS)
+			if len(self.cache) > self.CACHE_SIZE:
+				self.cache.popitem(last=False)
+		return self.cache[key]
+
+	def getHash(self):
+		hashes = [calibrator.getModelHash() for calibrator in self.calibrators]
+		return hashlib.sha1(json.dumps({'mode': self.mode, 'models': hashes, 'times': self.times}).encode('utf-8')).hexdigest()
+
+	def isCompatible(self, theFirst, theSecond):
+		first = theFirst.getModelParameters()
+		second = theSecond.getModelParameters()
+		for key in ('GAMMA', 'SUBTRACTION', 'PIXEL_RANGE'):
+			if first[key] != second[key]:
+				return False
+		return True
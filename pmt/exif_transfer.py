@@ -0,0 +1,135 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+#Carries a whitelist of the source image's EXIF (GPS, capture time and camera) into the TIFFs written from it, as IFD0
+#tags and an XMP packet passed to tifffile, so the outputs do not have to be reopened to add metadata.
+import datetime
+from fractions import Fraction
+from xml.sax.saxutils import escape
+
+#Tags read from the source image
+METADATA_TAGS = [
+	'Exif.Image.Make', 'Exif.Image.Model', 'Exif.Image.DateTime',
+	'Exif.Photo.DateTimeOriginal', 'Exif.Photo.DateTimeDigitized', 'Exif.Photo.SubSecTimeOriginal',
+	'Exif.Photo.ExposureTime', 'Exif.Photo.FNumber', 'Exif.Photo.FocalLength', 'Exif.Photo.ISOSpeedRatings',
+	'Exif.GPSInfo.GPSLatitudeRef', 'Exif.GPSInfo.GPSLatitude', 'Exif.GPSInfo.GPSLongitudeRef', 'Exif.GPSInfo.GPSLongitude',
+	'Exif.GPSInfo.GPSAltitudeRef', 'Exif.GPSInfo.GPSAltitude', 'Exif.GPSInfo.GPSTimeStamp', 'Exif.GPSInfo.GPSDateStamp',
+	'Exif.GPSInfo.GPSMapDatum'
+]
+
+#TIFF tag codes
+MAKE = 271
+MODEL = 272
+DATE_TIME = 306
+XMP = 700
+
+def extractMetadata(theExif):
+	#Whitelisted tags of pyexiv2 metadata as a dict of raw EXIF strings
+	metadata = {}
+	if theExif == None:
+		return metadata
+	for key in METADATA_TAGS:
+		try:
+			metadata[key] = str(theExif[key].raw_value).strip()
+		except (KeyError, AttributeError):
+			continue
+	return metadata
+
+def getTiffTags(theMetadata):
+	#tifffile extratags, i.e., (code, dtype, count, value, writeonce)
+	tags = []
+	for code, key in ((MAKE, 'Exif.Image.Make'), (MODEL, 'Exif.Image.Model')):
+		if key in theMetadata:
+			tags.append((code, 's', 0, theMetadata[key], True))
+	dateTime = theMetadata.get('Exif.Photo.DateTimeOriginal', theMetadata.get('Exif.Image.DateTime'))
+	if dateTime != None:
+		tags.append((DATE_TIME, 's', 0, dateTime, True))
+	packet = getXmpPacket(theMetadata)
+	if packet != None:
+		tags.append((XMP, 'B', len(packet), packet, True))
+	return tags
+
+def getXmpPacket(theMetadata):
+	properties = []
+	for key, name in (('Exif.Image.Make', 'tiff:Make'), ('Exif.Image.Model', 'tiff:Model'), ('Exif.Photo.ExposureTime', 'exif:ExposureTime'), ('Exif.Photo.FNumber', 'exif:FNumber'), ('Exif.Photo.FocalLength', 'exif:FocalLength'), ('Exif.GPSInfo.GPSAltitude', 'exif:GPSAltitude'), ('Exif.GPSInfo.GPSAltitudeRef', 'exif:GPSAltitudeRef'), ('Exif.GPSInfo.GPSMapDatum', 'exif:GPSMapDatum')):
+		if key in theMetadata:
+			properties.append((name, theMetadata[key]))
+	for key, name in (('Exif.Image.DateTime', 'xmp:ModifyDate'), ('Exif.Photo.DateTimeOriginal', 'exif:DateTimeOriginal'), ('Exif.Photo.DateTimeDigitized', 'exif:DateTimeDigitized')):
+		value = xmpDate(theMetadata.get(key), theMetadata.get('Exif.Photo.SubSecTimeOriginal') if key == 'Exif.Photo.DateTimeOriginal' else None)
+		if value != None:
+			properties.append((name, value))
+	for key, name in (('Exif.GPSInfo.GPSLatitude', 'exif:GPSLatitude'), ('Exif.GPSInfo.GPSLongitude', 'exif:GPSLongitude')):
+		value = xmpCoordinate(theMetadata.get(key), theMetadata.get(key + 'Ref'))
+		if value != None:
+			properties.append((name, value))
+	value = xmpGpsTime(theMetadata.get('Exif.GPSInfo.GPSDateStamp'), theMetadata.get('Exif.GPSInfo.GPSTimeStamp'))
+	if value != None:
+		properties.append(('exif:GPSTimeStamp', value))
+	if len(properties) == 0 and 'Exif.Photo.ISOSpeedRatings' not in theMetadata:
+		return None
+
+	elements = ['<%s>%s</%s>' % (name, escape(value), name) for name, value in properties]
+	if 'Exif.Photo.ISOSpeedRatings' in theMetadata:
+		items = ''.join(['<rdf:li>%s</rdf:li>' % escape(value) for value in theMetadata['Exif.Photo.ISOSpeedRatings'].split()])
+		elements.append('<exif:ISOSpeedRatings><rdf:Seq>%s</rdf:Seq></exif:ISOSpeedRatings>' % items)
+	packet = '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+	packet += '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+	packet += '<rdf:Description rdf:about="" xmlns:tiff="http://ns.adobe.com/tiff/1.0/" xmlns:exif="http://ns.adobe.com/exif/1.0/" xmlns:xmp="http://ns.adobe.com/xap/1.0/">'
+	packet += ''.join(elements)
+	packet += '</rdf:Description></rdf:RDF></x:xmpmeta><?xpacket end="w"?>'
+	return packet.encode('utf-8')
+
+def rationals(theValue):
+	return [Fraction(value) for value in theValue.split()]
+
+def xmpCoordinate(theValue, theReference):
+	#EXIF degrees, minutes, seconds to XMP's DDD,MM.mmmmmmR
+	if theValue == None or theReference == None:
+		return None
+	try:
+		parts = rationals(theValue)
+	except (ValueError, ZeroDivisionError):
+		return None
+	if len(parts) != 3:
+		return None
+	minutes = float(parts[1] + parts[2] / 60)
+	return '%d,%.6f%s' % (int(parts[0]), minutes, theReference)
+
+def xmpDate(theValue, theSubSeconds=None):
+	#EXIF 'YYYY:MM:DD HH:MM:SS' to ISO 8601
+	if theValue == None:
+		return None
+	try:
+		value = datetime.datetime.strptime(theValue, '%Y:%m:%d %H:%M:%S').isoformat()
+	except ValueError:
+		return None
+	if theSubSeconds != None and theSubSeconds.isdigit():
+		value += '.' + theSubSeconds
+	return value
+
+def xmpGpsTime(theDate, theTime):
+	#GPS date stamp and time of day, always UTC
+	if theDate == None or theTime == None:
+		return None
+	try:
+		hours, minutes, seconds = rationals(theTime)
+		date = datetime.datetime.strptime(theDate, '%Y:%m:%d')
+	except (ValueError, ZeroDivisionError):
+		return None
+	value = date + datetime.timedelta(hours=float(hours), minutes=float(minutes), seconds=float(seconds))
+	return value.strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
@@ -0,0 +1,239 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import ast
+import numpy as np
+
+#Names an index expression can use for the bands of an image, b1 - b3 are the bands in file order
+BAND_NAMES = ['red', 'green', 'blue', 'nir', 'b1', 'b2', 'b3']
+
+def fill(theValue, theTarget):
+	#A constant, or with theTarget an array of it
+	if theTarget is None:
+		return theValue
+	theTarget.fill(theValue)
+	return theTarget
+
+def safeDivide(theNumerator, theDenominator, out=None, mask=None):
+	#0 where the denominator is 0 instead of warnings and NaN / inf, mask is an optional boolean scratch array
+	if np.isscalar(theNumerator) and np.isscalar(theDenominator):
+		return theNumerator / theDenominator if theDenominator != 0 else 0.0
+	if out is None:
+		out = np.empty(np.broadcast(theNumerator, theDenominator).shape, dtype=np.result_type(theNumerator, theDenominator, np.float32))
+	if np.isscalar(theDenominator):
+		if theDenominator == 0:
+			out.fill(0.0)
+		else:
+			np.divide(theNumerator, theDenominator, out=out)
+		return out
+	if mask is None:
+		mask = np.empty(theDenominator.shape, dtype='bool')
+	np.not_equal(theDenominator, 0, out=mask)
+	np.divide(theNumerator, theDenominator, out=out, where=mask)
+	#Zero where nothing was divided, out may hold anything there, e.g., the numerator
+	np.logical_not(mask, out=mask)
+	np.copyto(out, 0.0, where=mask)
+	return out
+
+def safePower(theBase, theExponent, out=None):
+	with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+		if np.isscalar(theBase) and np.isscalar(theExponent):
+			result = np.power(theBase, theExponent)
+			return result if np.isfinite(result) else 0.0
+		result = np.power(theBase, theExponent, out=out)
+	return np.nan_to_num(result, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+class Evaluation():
+	#Scratch arrays for evaluating one index over one image. A temporary is handed back as soon as the operation using it
+	#has run, so an expression needs as many arrays as its tree is deep rather than one per operation. With theBuffers,
+	#e.g., CalibrationIndiciesProcessor.getBuffer, the arrays are also kept from one image to the next. Pixels where the
+	#index is undefined, a division by zero or a power that is not finite, are flagged in theInvalid when given.
+	def __init__(self, theShape, theDtype, theBuffers=None, theInvalid=None):
+		self.shape = theShape
+		self.dtype = theDtype
+		self.buffers = theBuffers
+		self.invalid = theInvalid
+		self.owned = []
+		self.free = []
+		self.mask = None
+		if self.invalid is not None:
+			self.invalid.fill(False)
+
+	def acquire(self):
+		if len(self.free) > 0:
+			return self.free.pop()
+		array = self.allocate('index-scratch' + str(len(self.owned)), self.dtype)
+		self.owned.append(array)
+		return array
+
+	def allocate(self, theName, theDtype):
+		if self.buffers != None:
+			return self.buffers(theName, self.shape, theDtype)
+		return np.empty(self.shape, dtype=theDtype)
+
+	def divide(self, theNumerator, theDenominator, theOut=None):
+		if np.isscalar(theDenominator):
+			if theDenominator == 0:
+				self.invalidate()
+			return safeDivide(theNumerator, theDenominator, out=theOut)
+		result = safeDivide(theNumerator, theDenominator, out=theOut, mask=self.getMask())
+		#safeDivide leaves the zero denominators in the mask
+		self.invalidate(self.mask)
+		return result
+
+	def getMask(self):
+		if self.mask is None:
+			self.mask = self.allocate('index-mask', 'bool')
+		return self.mask
+
+	def invalidate(self, theMask=None):
+		#Flag theMask, or every pixel when the expression is undefined as a whole
+		if self.invalid is None:
+			return
+		if theMask is None:
+			self.invalid.fill(True)
+		else:
+			np.logical_or(self.invalid, theMask, out=self.invalid)
+
+	def isOwned(self, theArray):
+		for array in self.owned:
+			if theArray is array:
+				return True
+		return False
+
+	def power(self, theBase, theExponent, theOut=None):
+		if np.isscalar(theBase) and np.isscalar(theExponent):
+			with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+				if not np.isfinite(np.power(float(theBase), float(theExponent))):
+					self.invalidate()
+			return safePower(theBase, theExponent)
+		if self.invalid is None:
+			return safePower(theBase, theExponent, out=theOut)
+		with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+			result = np.power(theBase, theExponent, out=theOut)
+		mask = self.getMask()
+		np.isfinite(result, out=mask)
+		np.logical_not(mask, out=mask)
+		self.invalidate(mask)
+		np.copyto(result, 0.0, where=mask)
+		return result
+
+	def release(self, *theArrays):
+		for array in theArrays:
+			if self.isOwned(array) and not any(array is free for free in self.free):
+				self.free.append(array)
+
+	def target(self, theTarget, *theOperands):
+		#Array for the result of an operation, the output of the whole expression or an operand that is not needed after it
+		if theTarget is not None:
+			return theTarget
+		for operand in theOperands:
+			if self.isOwned(operand):
+				return operand
+		return self.acquire()
+
+OPERATIONS = {
+	ast.Add: lambda theLeft, theRight, theOut, theEvaluation: np.add(theLeft, theRight, out=theOut),
+	ast.Sub: lambda theLeft, theRight, theOut, theEvaluation: np.subtract(theLeft, theRight, out=theOut),
+	ast.Mult: lambda theLeft, theRight, theOut, theEvaluation: np.multiply(theLeft, theRight, out=theOut),
+	ast.Div: lambda theLeft, theRight, theOut, theEvaluation: theEvaluation.divide(theLeft, theRight, theOut),
+	ast.Pow: lambda theLeft, theRight, theOut, theEvaluation: theEvaluation.power(theLeft, theRight, theOut)
+}
+
+class VegetationIndex():
+	def __init__(self, theName, theExpression, theRange, theDescription=''):
+		#theRange is the (minimum, maximum) the index takes for reflectance in [0, 1], it is the range output is scaled from
+		self.name = theName
+		self.expression = theExpression
+		self.minimum, self.maximum = theRange
+		self.description = theDescription
+		self.evaluator = self.compile(ast.parse(theExpression, mode='eval').body)
+
+	def compile(self, theNode):
+		#Expression tree to nested closures over NumPy, done once so evaluation is just the array math. Each closure takes
+		#the bands, the Evaluation and the array its result has to go to (None for a scalar, a band or a temporary).
+		if isinstance(theNode, ast.BinOp) and type(theNode.op) in OPERATIONS:
+			operation = OPERATIONS[type(theNode.op)]
+			left = self.compile(theNode.left)
+			right = self.compile(theNode.right)
+			def evaluate(theBands, theEvaluation, theTarget=None):
+				leftValue = left(theBands, theEvaluation)
+				rightValue = right(theBands, theEvaluation)
+				if np.isscalar(leftValue) and np.isscalar(rightValue):
+					return fill(operation(leftValue, rightValue, None, theEvaluation), theTarget)
+				out = theEvaluation.target(theTarget, leftValue, rightValue)
+				operation(leftValue, rightValue, out, theEvaluation)
+				theEvaluation.release(*[value for value in (leftValue, rightValue) if value is not out])
+				return out
+			return evaluate
+		if isinstance(theNode, ast.UnaryOp) and isinstance(theNode.op, (ast.USub, ast.UAdd)):
+			operand = self.compile(theNode.operand)
+			if isinstance(theNode.op, ast.UAdd):
+				return operand
+			def negate(theBands, theEvaluation, theTarget=None):
+				value = operand(theBands, theEvaluation)
+				if np.isscalar(value):
+					return fill(-value, theTarget)
+				return np.negative(value, out=theEvaluation.target(theTarget, value))
+			return negate
+		if isinstance(theNode, ast.Constant) and isinstance(theNode.value, (int, float)) and not isinstance(theNode.value, bool):
+			value = float(theNode.value)
+			return lambda theBands, theEvaluation, theTarget=None: fill(value, theTarget)
+		if isinstance(theNode, ast.Name) and theNode.id.lower() in BAND_NAMES:
+			name = theNode.id.lower()
+			def band(theBands, theEvaluation, theTarget=None):
+				if theTarget is None:
+					return theBands[name]
+				np.copyto(theTarget, theBands[name])
+				return theTarget
+			return band
+		raise ValueError('Unsupported element in index expression %s: %s' % (self.expression, ast.dump(theNode)))
+
+	def evaluate(self, theImage, theBandNumbers, out=None, buffers=None, invalid=None):
+		#theBandNumbers maps band names to 1 based band numbers, result has the shape (rows, columns, 1). out is an
+		#optional (rows, columns) array for the result and buffers a getBuffer(name, shape, dtype) for the temporaries.
+		#invalid is an optional (rows, columns) boolean array set where the index is undefined, those pixels are 0.
+		bands = {}
+		for name in BAND_NAMES:
+			if name in theBandNumbers:
+				bands[name] = theImage[:,:,theBandNumbers[name] - 1]
+		for band in range(theImage.shape[2]):
+			bands['b' + str(band + 1)] = theImage[:,:,band]
+		dtype = np.result_type(theImage.dtype, np.float32)
+		if out is None:
+			out = np.empty(theImage.shape[0:2], dtype=dtype)
+		self.evaluator(bands, Evaluation(theImage.shape[0:2], dtype, buffers, invalid), out)
+		return out.reshape(theImage.shape[0:2] + (1,))
+
+INDICIES = {}
+
+def getIndex(theName):
+	if theName not in INDICIES:
+		raise KeyError('Unknown index %s' % theName)
+	return INDICIES[theName]
+
+def registerIndex(theName, theExpression, theRange=(-1.0, 1.0), theDescription=''):
+	#User defined indices, e.g., registerIndex('NDRE', '(nir - b2) / (nir + b2)')
+	INDICIES[theName] = VegetationIndex(theName, theExpression, theRange, theDescription)
+	return INDICIES[theName]
+
+registerIndex('NDVI', '(nir - red) / (nir + red)', (-1.0, 1.0), 'Normalized Difference Vegetation Index')
+registerIndex('GNDVI', '(nir - green) / (nir + green)', (-1.0, 1.0), 'Green Normalized Difference Vegetation Index')
+registerIndex('SAVI', '1.5 * (nir - red) / (nir + red + 0.5)', (-1.0, 1.0), 'Soil Adjusted Vegetation Index, L = 0.5')
+registerIndex('EVI2', '2.5 * (nir - red) / (nir + 2.4 * red + 1)', (-1.0, 1.25), 'Two-band Enhanced Vegetation Index')
+registerIndex('DVI', 'nir - red', (-1.0, 1.0), 'Difference Vegetation Index')
@@ -0,0 +1,173 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+#Per-image, per-stage timings of the processing loop delivered to pluggable sinks, e.g.,
+#	instrumentation = Instrumentation()
+#	instrumentation.addSink(JsonLinesSink('timings.jsonl'))
+#	processor.instrumentation = instrumentation
+#Without an Instrumentation on the processor no records are made, the loop only checks for None.
+import os, json, time
+
+class ImageRecord():
+	#Stage timings in seconds, bytes read and written and the size of the largest array of one image
+	STAGES = ['read', 'exif', 'calibrate', 'index', 'scale', 'cast', 'write']
+	#Stages that run inside writeImage() when tiles are computed as they are written
+	COMPUTE_STAGES = ['calibrate', 'index', 'scale', 'cast']
+
+	def __init__(self, theFile):
+		self.file = theFile
+		self.stages = dict.fromkeys(self.STAGES, 0.0)
+		self.bytesRead = 0
+		self.bytesWritten = 0
+		self.peakArrayBytes = 0
+		self.error = None
+		self.started = time.perf_counter()
+		self.seconds = 0.0
+
+	def array(self, theArray):
+		self.peakArrayBytes = max(self.peakArrayBytes, theArray.nbytes)
+
+	def asDict(self):
+		return {'file': os.path.basename(self.file), 'seconds': self.seconds, 'stages': dict(self.stages), 'bytesRead': self.bytesRead, 'bytesWritten': self.bytesWritten, 'peakArrayBytes': self.peakArrayBytes, 'error': self.error}
+
+	def computeSeconds(self):
+		return sum([self.stages[stage] for stage in self.COMPUTE_STAGES])
+
+	def finish(self, theError=None):
+		self.error = theError
+		self.seconds = time.perf_counter() - self.started
+		return self
+
+	def start(self):
+		return time.perf_counter()
+
+	def stop(self, theStage, theStart, theExcluded=0.0):
+		#Add the time since theStart, less theExcluded seconds already counted by other stages, to theStage
+		self.stages[theStage] += time.perf_counter() - theStart - theExcluded
+
+class Instrumentation():
+	def __init__(self):
+		self.sinks = []
+
+	def addSink(self, theSink):
+		self.sinks.append(theSink)
+		return theSink
+
+	def close(self):
+		for sink in self.sinks:
+			sink.close()
+
+	def emit(self, theRecord):
+		for sink in self.sinks:
+			sink.record(theRecord)
+
+	def flush(self):
+		#End of a run
+		for sink in self.sinks:
+			sink.flush()
+
+class CallbackSink():
+	#Calls theCallback with each record as a dict
+	def __init__(self, theCallback):
+		self.callback = theCallback
+
+	def close(self):
+		pass
+
+	def flush(self):
+		pass
+
+	def record(self, theRecord):
+		self.callback(theRecord.asDict())
+
+class JsonLinesSink():
+	#Appends one JSON object per image to theFileName
+	def __init__(self, theFileName):
+		self.fileName = theFileName
+		self.file = None
+
+	def close(self):
+		if self.file != None:
+			self.file.close()
+			self.file = None
+
+	def flush(self):
+		if self.file != None:
+			self.file.flush()
+
+	def record(self, theRecord):
+		if self.file == None:
+			self.file = open(self.fileName, 'a')
+		record = theRecord.asDict()
+		record['time'] = time.time()
+		self.file.write(json.dumps(record) + '\n')
+		self.file.flush()
+
+class PrometheusSink():
+	#Running totals in the Prometheus text format, e.g., for the node exporter textfile collector. The file is rewritten
+	#atomically every UPDATE_INTERVAL images and at the end of each run.
+	UPDATE_INTERVAL = 10
+
+	def __init__(self, theFileName, theLabels=None):
+		self.fileName = theFileName
+		self.labels = theLabels or {}
+		self.images = 0
+		self.failed = 0
+		self.seconds = 0.0
+		self.stages = dict.fromkeys(ImageRecord.STAGES, 0.0)
+		self.bytesRead = 0
+		self.bytesWritten = 0
+		self.peakArrayBytes = 0
+
+	def close(self):
+		self.flush()
+
+	def flush(self):
+		lines = []
+		lines += self.metric('pmt_images_total', 'counter', 'Images processed', [({}, self.images)])
+		lines += self.metric('pmt_images_failed_total', 'counter', 'Images that failed to process', [({}, self.failed)])
+		lines += self.metric('pmt_image_seconds_total', 'counter', 'Wall time spent on images', [({}, self.seconds)])
+		lines += self.metric('pmt_stage_seconds_total', 'counter', 'Time spent in each processing stage', [({'stage': stage}, self.stages[stage]) for stage in ImageRecord.STAGES])
+		lines += self.metric('pmt_read_bytes_total', 'counter', 'Bytes of source images read', [({}, self.bytesRead)])
+		lines += self.metric('pmt_written_bytes_total', 'counter', 'Bytes of outputs written', [({}, self.bytesWritten)])
+		lines += self.metric('pmt_peak_array_bytes', 'gauge', 'Largest array held for a single image', [({}, self.peakArrayBytes)])
+		temporary = self.fileName + '.tmp'
+		with open(temporary, 'w') as file:
+			file.write('\n'.join(lines) + '\n')
+		os.replace(temporary, self.fileName)
+
+	def metric(self, theName, theType, theHelp, theSamples):
+		lines = ['# HELP %s %s' % (theName, theHelp), '# TYPE %s %s' % (theName, theType)]
+		for labels, value in theSamples:
+			labels = dict(self.labels, **labels)
+			text = ','.join(['%s="%s"' % (key, str(labels[key]).replace('\\', '\\\\').replace('"', '\\"')) for key in sorted(labels)])
+			lines.append('%s%s %s' % (theName, '{' + text + '}' if text != '' else '', repr(float(value)) if isinstance(value, float) else value))
+		return lines
+
+	def record(self, theRecord):
+		self.images += 1
+		if theRecord.error != None:
+			self.failed += 1
+		self.seconds += theRecord.seconds
+		for stage in self.stages:
+			self.stages[stage] += theRecord.stages[stage]
+		self.bytesRead += theRecord.bytesRead
+		self.bytesWritten += theRecord.bytesWritten
+		self.peakArrayBytes = max(self.peakArrayBytes, theRecord.peakArrayBytes)
+		if self.images % self.UPDATE_INTERVAL == 0:
+			self.flush()
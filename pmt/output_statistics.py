@@ -0,0 +1,160 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import os, csv, time
+import numpy as np
+
+class IndexStatistics():
+	#Streaming summary of index values. Count, minimum, maximum, mean and standard deviation are exact, percentiles come
+	#from a fixed-bin histogram over the index range so summaries of tiles, images and batches merge without the pixels.
+	BINS = 256
+	PERCENTILES = [5, 25, 50, 75, 95]
+
+	def __init__(self, theMinimum, theMaximum, theBins=None):
+		self.minimum = theMinimum
+		self.maximum = theMaximum
+		self.bins = theBins if theBins != None else self.BINS
+		self.pixels = 0
+		self.valid = 0
+		self.total = 0.0
+		self.totalSquares = 0.0
+		self.low = np.inf
+		self.high = -np.inf
+		self.histogram = np.zeros(self.bins, dtype='int64')
+
+	def add(self, theValues, theInvalid=None):
+		#Valid values are finite, inside the index range and not flagged in theInvalid, e.g., a division by zero
+		values = theValues.reshape(-1)
+		self.pixels += values.size
+		valid = np.isfinite(values)
+		if theInvalid is not None:
+			np.logical_and(valid, np.logical_not(theInvalid.reshape(-1)), out=valid)
+		np.logical_and(valid, values >= self.minimum, out=valid)
+		np.logical_and(valid, values <= self.maximum, out=valid)
+		count = int(np.count_nonzero(valid))
+		if count == 0:
+			return
+		if count != values.size:
+			values = values[valid]
+		self.valid += count
+		self.total += float(np.sum(values, dtype='float64'))
+		self.totalSquares += float(np.sum(np.square(values), dtype='float64'))
+		self.low = min(self.low, float(values.min()))
+		self.high = max(self.high, float(values.max()))
+		bins = ((values - self.minimum) * (self.bins / (self.maximum - self.minimum))).astype('int32')
+		np.minimum(bins, self.bins - 1, out=bins)
+		self.histogram += np.bincount(bins, minlength=self.bins)
+
+	def merge(self, theOther):
+		self.pixels += theOther.pixels
+		self.valid += theOther.valid
+		self.total += theOther.total
+		self.totalSquares += theOther.totalSquares
+		self.low = min(self.low, theOther.low)
+		self.high = max(self.high, theOther.high)
+		self.histogram += theOther.histogram
+
+	def percentile(self, thePercent):
+		#Value at the centre of the bin holding the percentile
+		if self.valid == 0:
+			return None
+		bin = int(np.searchsorted(np.cumsum(self.histogram), self.valid * thePercent / 100.0))
+		return self.minimum + (min(bin, self.bins - 1) + 0.5) * (self.maximum - self.minimum) / self.bins
+
+	def summary(self):
+		summary = {'pixels': self.pixels, 'validFraction': self.valid / self.pixels if self.pixels > 0 else 0.0}
+		summary['min'] = self.low if self.valid > 0 else None
+		summary['max'] = self.high if self.valid > 0 else None
+		summary['mean'] = self.total / self.valid if self.valid > 0 else None
+		summary['std'] = None
+		if self.valid > 0:
+			summary['std'] = max(0.0, self.totalSquares / self.valid - summary['mean'] ** 2) ** 0.5
+		for percent in self.PERCENTILES:
+			summary['p' + str(percent)] = self.percentile(percent)
+		summary['histogram'] = self.histogram.tolist()
+		return summary
+
+class OutputStatistics():
+	#Sidecar of per-image index statistics and the batch aggregate, rows are written as images finish so memory stays
+	#constant whatever the number of images. Each run writes its own file, a resumed run summarizes the images it processed.
+	FORMATS = ['csv', 'parquet']
+	COLUMNS = ['scope', 'image', 'index', 'pixels', 'validFraction', 'min', 'max', 'mean', 'std'] + ['p' + str(percent) for percent in IndexStatistics.PERCENTILES] + ['histogram']
+	#Rows per Parquet row group
+	ROW_GROUP = 64
+
+	def __init__(self, theDirectory, theFormat='csv'):
+		if theFormat not in self.FORMATS:
+			raise ValueError('Unknown statistics format %s, expected one of %s' % (theFormat, ', '.join(self.FORMATS)))
+		self.format = theFormat
+		self.fileName = os.path.join(theDirectory, 'pmt-statistics-' + time.strftime('%Y%m%d-%H%M%S') + '.' + theFormat)
+		self.batch = {}
+		self.rows = []
+		self.file = None
+		self.writer = None
+		if theFormat == 'parquet':
+			#Optional dependency, only needed for Parquet output
+			import pyarrow
+			import pyarrow.parquet
+			fields = [(column, pyarrow.string()) for column in self.COLUMNS[0:3]]
+			fields += [('pixels', pyarrow.int64())] + [(column, pyarrow.float64()) for column in self.COLUMNS[4:-1]]
+			fields.append(('histogram', pyarrow.list_(pyarrow.int64())))
+			self.schema = pyarrow.schema(fields)
+			self.writer = pyarrow.parquet.ParquetWriter(self.fileName, self.schema)
+		else:
+			self.file = open(self.fileName, 'w', newline='')
+			self.writer = csv.writer(self.file)
+			self.writer.writerow(self.COLUMNS)
+
+	def close(self):
+		#Batch aggregate then close the file
+		for name in sorted(self.batch):
+			self.writeRow('batch', '', name, self.batch[name].summary())
+		self.flush()
+		if self.file != None:
+			self.file.close()
+		else:
+			self.writer.close()
+		self.writer = None
+
+	def flush(self):
+		if self.format == 'parquet' and len(self.rows) > 0:
+			import pyarrow
+			columns = list(zip(*self.rows))
+			self.writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(columns[i], type=self.schema.field(i).type) for i in range(len(self.COLUMNS))], schema=self.schema))
+			self.rows = []
+		elif self.file != None:
+			self.file.flush()
+
+	def record(self, theFile, theStatistics):
+		#theStatistics maps index names to the image's IndexStatistics
+		for name in sorted(theStatistics):
+			statistics = theStatistics[name]
+			self.writeRow('image', os.path.basename(theFile), name, statistics.summary())
+			if name not in self.batch:
+				self.batch[name] = IndexStatistics(statistics.minimum, statistics.maximum, statistics.bins)
+			self.batch[name].merge(statistics)
+
+	def writeRow(self, theScope, theImage, theIndex, theSummary):
+		row = [theScope, theImage, theIndex] + [theSummary[column] for column in self.COLUMNS[3:]]
+		if self.format == 'parquet':
+			self.rows.append(row)
+			if len(self.rows) >= self.ROW_GROUP:
+				self.flush()
+		else:
+			row[-1] = ' '.join([str(count) for count in row[-1]])
+			self.writer.writerow(row)
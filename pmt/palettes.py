@@ -0,0 +1,56 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import numpy as np
+
+#Color tables for paletted output, 256 RGB entries each, built once when registered
+PALETTES = {}
+
+def getPalette(theName):
+	#(256, 3) uint8 table, matplotlib colormaps are used when available for names not registered here
+	if theName not in PALETTES:
+		try:
+			from matplotlib import colormaps
+			colors = colormaps[theName](np.linspace(0.0, 1.0, 256))[:,0:3]
+		except (ImportError, KeyError):
+			raise KeyError('Unknown LUT %s' % theName)
+		registerPalette(theName, np.round(colors * 255))
+	return PALETTES[theName]
+
+def getTiffColormap(theName):
+	#TIFF palettes are (3, 256) uint16
+	return (getPalette(theName).T.astype('uint16') * 257)
+
+def registerPalette(theName, theColors):
+	#theColors is either a (256, 3) table or control points [(position, (r, g, b)), ...] with positions from 0 to 1
+	if len(theColors[0]) == 3:
+		table = np.asarray(theColors).astype('uint8').reshape(256, 3)
+	else:
+		positions = [point[0] for point in theColors]
+		values = np.linspace(0.0, 1.0, 256)
+		table = np.empty((256, 3), dtype='uint8')
+		for band in range(3):
+			table[:,band] = np.round(np.interp(values, positions, [point[1][band] for point in theColors]))
+	PALETTES[theName] = table
+	return table
+
+registerPalette('NDVI', [(0.0, (0, 0, 128)), (0.45, (255, 255, 255)), (0.5, (200, 160, 100)), (0.6, (255, 255, 0)), (0.8, (0, 200, 0)), (1.0, (0, 80, 0))])
+registerPalette('RdYlGn', [(0.0, (165, 0, 38)), (0.25, (244, 109, 67)), (0.5, (255, 255, 191)), (0.75, (102, 189, 99)), (1.0, (0, 104, 55))])
+registerPalette('Jet', [(0.0, (0, 0, 128)), (0.125, (0, 0, 255)), (0.375, (0, 255, 255)), (0.625, (255, 255, 0)), (0.875, (255, 0, 0)), (1.0, (128, 0, 0))])
+registerPalette('Fire', [(0.0, (0, 0, 0)), (0.3, (150, 0, 120)), (0.55, (255, 60, 0)), (0.8, (255, 200, 0)), (1.0, (255, 255, 255))])
+registerPalette('Viridis', [(0.0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)), (0.75, (94, 201, 98)), (1.0, (253, 231, 37))])
@@ -0,0 +1,98 @@
+# Creation Date: 2026-10-18
+# Author(s):
+#		Peter J. Ersts (ersts@amnh.org)
+#	
+# This file is part of Photo Monitoring Toolkit (PMT).
+#
+# PMT is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# PMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PMT.  If not, see <http://www.gnu.org/licenses/>.
+import os, json, hashlib
+
+class ProcessingManifest():
+	#Record of what has been produced in a destination directory so re-runs only process new or changed images
+	#Entry format: {source base name: {parameters hash: {'size': bytes, 'mtime': seconds, 'sha1': content hash or None, 'parameters': hash, 'outputs': [names], 'model': calibration model hash or None}}}
+	#One entry per parameter set, so e.g. alternating preview and full runs into one destination each stay current
+	FILE_NAME = '.pmt-manifest.json'
+	VERSION = 2
+
+	def __init__(self, theDirectory):
+		self.directory = theDirectory
+		self.fileName = os.path.join(theDirectory, self.FILE_NAME)
+		self.entries = {}
+		self.load()
+
+	def fingerprint(self, theFile, theHashContent=False):
+		stat = os.stat(theFile)
+		fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': None}
+		if theHashContent:
+			sha1 = hashlib.sha1()
+			with open(theFile, 'rb') as file:
+				for chunk in iter(lambda: file.read(1048576), b''):
+					sha1.update(chunk)
+			fingerprint['sha1'] = sha1.hexdigest()
+		return fingerprint
+
+	def isCurrent(self, theFile, theFingerprint, theParameters):
+		entry = self.entries.get(os.path.basename(theFile), {}).get(theParameters)
+		if entry == None or entry['size'] != theFingerprint['size']:
+			return False
+		#Prefer the content hash when both runs have one, a touched but unchanged file is still current
+		if entry['sha1'] != None and theFingerprint['sha1'] != None:
+			if entry['sha1'] != theFingerprint['sha1']:
+				return False
+		elif entry['mtime'] != theFingerprint['mtime']:
+			return False
+		for output in entry['outputs']:
+			if not os.path.exists(os.path.join(self.directory, output)):
+				return False
+		return True
+
+	def load(self):
+		try:
+			with open(self.fileName, 'r') as file:
+				manifest = json.load(file)
+			if manifest.get('VERSION') == self.VERSION:
+				self.entries = manifest['FILES']
+			elif manifest.get('VERSION') == 1:
+				#Version 1 kept only the last run of each source
+				self.entries = dict([(name, {entry['parameters']: entry}) for name, entry in manifest['FILES'].items()])
+		except (IOError, ValueError, KeyError):
+			self.entries = {}
+
+	def record(self, theFile, theFingerprint, theParameters, theOutputs, theModel=None):
+		entry = dict(theFingerprint)
+		entry['parameters'] = theParameters
+		entry['outputs'] = list(theOutputs)
+		entry['model'] = theModel
+		#Runs with other parameters that wrote any of the same outputs are no longer on disk as recorded
+		self.remove(theFile, entry['outputs'])
+		self.entries.setdefault(os.path.basename(theFile), {})[theParameters] = entry
+
+	def remove(self, theFile, theOutputs=None):
+		#Entries of the source sharing any of theOutputs, e.g., ones a failed run may have overwritten, or all of them
+		name = os.path.basename(theFile)
+		if theOutputs != None:
+			entries = self.entries.get(name, {})
+			for parameters in list(entries):
+				if len(set(entries[parameters]['outputs']) & set(theOutputs)) > 0:
+					del entries[parameters]
+			if len(entries) > 0:
+				return
+		self.entries.pop(name, None)
+
+	def save(self):
+		#Write then rename so an interrupted run never leaves a truncated manifest
+		temporary = self.fileName + '.tmp'
+		with open(temporary, 'w') as file:
+			json.dump({'VERSION': self.VERSION, 'FILES': self.entries}, file, indent=1, sort_keys=True)
+		os.replace(temporary, self.fileName)
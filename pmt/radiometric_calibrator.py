@@ -16,17 +16,90 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with PMT.  If not, see <http://www.gnu.org/licenses/>.
-import sys, os, math
+import sys, os, math, hashlib, datetime
 import numpy as np
 import pyexiv2, json
 import cv2
-from scipy.stats import linregress as LinearRegression
+try:
+	#Optional, needed only for RAW/DNG input
+	import rawpy
+except ImportError:
+	rawpy = None
+
+#Camera RAW formats decoded with rawpy rather than OpenCV
+RAW_EXTENSIONS = ('.dng', '.cr2', '.cr3', '.nef', '.arw', '.orf', '.rw2', '.raf', '.pef', '.srw')
+#Reduced resolution decodes, JPEGs are scaled in the DCT domain without decoding the full image
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def exifDateTime(theMetadata):
+	#Capture time from pyexiv2 metadata, None when the image does not have one
+	for key in ('Exif.Photo.DateTimeOriginal', 'Exif.Image.DateTime'):
+		try:
+			value = theMetadata[key].value
+		except (KeyError, AttributeError):
+			continue
+		if isinstance(value, datetime.datetime):
+			return value
+		try:
+			return datetime.datetime.strptime(str(value).strip(), '%Y:%m:%d %H:%M:%S')
+		except ValueError:
+			continue
+	return None
+
+def isRaw(theFile):
+	return os.path.splitext(theFile)[1].lower() in RAW_EXTENSIONS
+
+def pixelMaximum(theImage):
+	#White level implied by the image's bit depth, floating point images are expected to be in [0, 1]
+	if np.issubdtype(theImage.dtype, np.integer):
+		return np.iinfo(theImage.dtype).max
+	return 1.0
+
+def readImageData(theFile, theContiguous=True, theReduction=1):
+	#RGB image at its native bit depth, RAW files are demosaiced to linear 16 bit.
+	#Without theContiguous the channels of OpenCV decoded images may be a reversed view of the BGR data.
+	#theReduction of 2, 4 or 8 divides the width and height, e.g., for quick looks.
+	if theReduction not in (1, 2, 4, 8):
+		raise ValueError('Unsupported reduction %s, expected 1, 2, 4 or 8' % theReduction)
+	if isRaw(theFile):
+		if rawpy == None:
+			raise IOError('rawpy is required to read RAW images')
+		with rawpy.imread(theFile) as raw:
+			#Half size skips demosaicing, each 2x2 Bayer block becomes one pixel
+			data = raw.postprocess(gamma=(1, 1), no_auto_bright=True, output_bps=16, use_camera_wb=True, half_size=theReduction > 1)
+		return reduceImage(data, theReduction // 2)
+	extension = os.path.splitext(theFile)[1].lower()
+	if theReduction > 1 and extension in ('.jpg', '.jpeg'):
+		#8 bit anyway, so nothing is lost by the reduced colour modes
+		data = cv2.imread(theFile, REDUCED_FLAGS[theReduction])
+	else:
+		#Any depth but always three bands, unlike IMREAD_UNCHANGED the EXIF orientation is still applied
+		data = cv2.imread(theFile, cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH)
+		if data is not None:
+			data = reduceImage(data, theReduction)
+	if data is None:
+		raise IOError('Unable to read image')
+	if theContiguous:
+		#Swapped in place, the decoded buffer is the only full size copy
+		return cv2.cvtColor(data, cv2.COLOR_BGR2RGB, dst=data)
+	return data[:,:,::-1]
+
+def reduceImage(theImage, theReduction):
+	#Area average over theReduction x theReduction blocks, the partial blocks at the right and bottom edges are dropped
+	if theReduction <= 1:
+		return theImage
+	return cv2.resize(theImage, (theImage.shape[1] // theReduction, theImage.shape[0] // theReduction), interpolation=cv2.INTER_AREA)
 
 class RadiometricCalibrator():
 #Individual ROI entry format: [Label, [Calibration R,G,B], [ROI X, Y, width, height], [ROI Means R,G,B]]
+	#Version of the model file written by saveModel()
+	MODEL_VERSION = 1
+
 	def __init__(self):
 		self.rois = []
 		self.fileName = ''
+		#Capture time of the calibration image, used to pick calibrations from a CalibrationLibrary
+		self.dateTime = None
 		self.image = None
 		self.model = None
 		self.gamma = 2.2
@@ -35,49 +108,186 @@ class RadiometricCalibrator():
 		self.subtractionPercent = 0
 		self.subtractionSourceBand = 3
 		self.subtractionFromBand = 1
+		#True when the loaded image is linear sensor data (RAW), the gamma then defaults to 0, i.e., off
+		self.linear = False
+		#Decode the image at 1/2, 1/4 or 1/8 size, ROI coordinates stay in full resolution pixels
+		self.reduction = 1
+		#Calibration tables for 8 bit input, rebuilt whenever the parameters they were built from change
+		self.useLookupTables = True
+		self.lookupTables = {}
 
-	def calibrate(self, theImage):
+	def calibrate(self, theImage, out=None, maxValue=None):
+		#maxValue is the white level of theImage when it differs from that of the calibration image, e.g., 16 bit input
 		if self.model == None:
+			if out is not None:
+				np.copyto(out, theImage, casting='unsafe')
+				return out
 			return theImage
-		image = self.preprocessPixels(theImage)
+		if out is not None:
+			return self.calibrateInPlace(theImage, out, maxValue)
+		image = self.preprocessPixels(theImage, maxValue=maxValue)
 		for band in range(3):
 			image[:,:,band] = (self.model[band]['slope'] * image[:,:,band]) + self.model[band]['intercept']
 		image[ image < 0] = 0.0
 		image[ image > 1.0] = 1.0
 		return image
 
+	def calibrateInPlace(self, theImage, theOut, theMaxValue=None):
+		#Same as calibrate() but all work is done in theOut (e.g., a reusable float32 buffer) without temporaries
+		if self.useLookupTables and theImage.dtype.name == 'uint8':
+			return self.calibrateWithLookupTables(theImage, theOut, theMaxValue)
+		self.preprocessPixels(theImage, out=theOut, maxValue=theMaxValue)
+		for band in range(3):
+			view = theOut[:,:,band]
+			np.multiply(view, float(self.model[band]['slope']), out=view)
+			np.add(view, float(self.model[band]['intercept']), out=view)
+		np.clip(theOut, 0.0, 1.0, out=theOut)
+		return theOut
+
+	def calibrateWithLookupTables(self, theImage, theOut, theMaxValue=None):
+		tables = self.getLookupTables(theMaxValue)
+		if theOut.flags['C_CONTIGUOUS']:
+			#Gather all three bands in a single pass
+			cv2.LUT(theImage, tables['interleaved'], dst=theOut)
+		else:
+			for band in range(3):
+				np.take(tables['calibrated'][band], theImage[:,:,band], out=theOut[:,:,band])
+		if self.subtractionPercent != 0:
+			#The subtraction band comes from a 2-D table indexed by (source code << 8) | from code
+			index = np.left_shift(theImage[:,:,self.subtractionSourceBand-1], 8, dtype='uint16')
+			np.bitwise_or(index, theImage[:,:,self.subtractionFromBand-1], out=index)
+			np.take(tables['subtracted'], index, out=theOut[:,:,self.subtractionFromBand-1])
+		return theOut
+
+	def copy(self):
+		#Plain copy of the calibration parameters and model, without the image, e.g., for shipping to worker processes
+		calibrator = RadiometricCalibrator()
+		calibrator.rois = [list(roi) for roi in self.rois]
+		calibrator.fileName = self.fileName
+		calibrator.dateTime = self.dateTime
+		calibrator.gamma = self.gamma
+		calibrator.minPixelValue = self.minPixelValue
+		calibrator.maxPixelValue = self.maxPixelValue
+		calibrator.subtractionPercent = self.subtractionPercent
+		calibrator.subtractionSourceBand = self.subtractionSourceBand
+		calibrator.subtractionFromBand = self.subtractionFromBand
+		calibrator.linear = self.linear
+		if self.model != None:
+			calibrator.model = [dict(band) for band in self.model]
+		return calibrator
+
+	@classmethod
+	def fromFile(cls, theFileName):
+		#Calibrator from a calibration image with saved ROIs or a model file written by saveModel()
+		calibrator = cls()
+		if theFileName.lower().endswith('.json'):
+			calibrator.loadModel(theFileName)
+		else:
+			#Only the ROIs saved in the EXIF are needed, not the pixels
+			calibrator.reduction = 8
+			if not calibrator.loadImage(theFileName):
+				raise IOError('Unable to load calibration image %s' % theFileName)
+		return calibrator
+
 	def generateModel(self):
 		#TODO: Make model dynamic in size for > 3 bands -- based on bands or mode?
 		if len(self.rois) > 1:
 			self.model = [{'data': {'x': [], 'y': []}, 'slope': 0, 'intercept': 0, 'r-value': 0}, {'data': {'x': [], 'y': []}, 'slope': 0, 'intercept': 0, 'r-value': 0}, {'data': {'x': [], 'y': []}, 'slope': 0, 'intercept': 0, 'r-value': 0}]
-			for roi in self.rois:
-				#If the width is not 0 we have means for the roi, so process
-				if roi[2][2] != 0:
-					array = np.reshape(np.array(roi[3]), (1,1,3))
-					stack = self.preprocessPixels(array)
-					for band in range(3):
-						self.model[band]['data']['x'].append(stack[0,0,band]) #X: pixel mean
-						self.model[band]['data']['y'].append(roi[1][band]) #Y: calibration
-			if len(self.model[0]['data']['x']) > 1:
+			#If the width is not 0 we have means for the roi, so process
+			rois = [roi for roi in self.rois if roi[2][2] != 0]
+			if len(rois) > 1:
+				#All ROI means are preprocessed in one pass, as a column of pixels
+				x = self.preprocessPixels(np.array([roi[3] for roi in rois], dtype='float64').reshape(-1, 1, 3))[:,0,:] #X: pixel mean
+				y = np.array([roi[1] for roi in rois], dtype='float64') #Y: calibration
+				slope, intercept, rValue = self.linearRegression(x, y)
 				for band in range(3):
-					self.model[band]['slope'], self.model[band]['intercept'], self.model[band]['r-value'], _, _ = LinearRegression(self.model[band]['data']['x'], self.model[band]['data']['y'])
-				return True
+					self.model[band]['data']['x'] = x[:,band].tolist()
+					self.model[band]['data']['y'] = y[:,band].tolist()
+				if np.all(np.isfinite(slope)):
+					for band in range(3):
+						self.model[band]['slope'] = float(slope[band])
+						self.model[band]['intercept'] = float(intercept[band])
+						self.model[band]['r-value'] = float(rValue[band])
+					return True
 		return False
 
+	def getDisplayImage(self):
+		#8 bit RGB copy of the loaded image for display, linear images are gamma encoded so they are not too dark
+		if self.image is None or self.image.dtype.name == 'uint8':
+			return self.image
+		image = self.image.astype('float32') / pixelMaximum(self.image)
+		if self.linear:
+			np.power(image, 1.0/2.2, out=image)
+		return np.clip(image * 255.0 + 0.5, 0, 255).astype('uint8')
+
+	def getLookupTables(self, theMaxValue=None):
+		maxValue = self.maxPixelValue if theMaxValue == None else theMaxValue
+		key = (self.minPixelValue, maxValue, self.gamma, self.subtractionPercent, self.subtractionSourceBand, self.subtractionFromBand, tuple((band['slope'], band['intercept']) for band in self.model))
+		if self.lookupTables.get('key') == key:
+			return self.lookupTables
+
+		#Same math as preprocessPixels() and calibrate(), evaluated once per possible 8 bit input code
+		codes = np.arange(256, dtype='float64')
+		preprocessed = (1.0/(maxValue - self.minPixelValue)) * (codes - self.minPixelValue)
+		if self.gamma != 0.0:
+			preprocessed = np.power(preprocessed, 1.0/self.gamma)
+		if self.subtractionPercent != 0:
+			preprocessed = np.maximum(preprocessed, 0.0)
+		calibrated = np.empty((3, codes.size), dtype='float32')
+		for band in range(3):
+			calibrated[band] = np.clip((self.model[band]['slope'] * preprocessed) + self.model[band]['intercept'], 0.0, 1.0)
+		#Layout expected by cv2.LUT for a three channel image
+		tables = {'key': key, 'calibrated': calibrated, 'interleaved': np.ascontiguousarray(calibrated.T).reshape(1, codes.size, 3)}
+		if self.subtractionPercent != 0:
+			band = self.subtractionFromBand - 1
+			subtracted = np.maximum(preprocessed[np.newaxis,:] - (preprocessed[:,np.newaxis] * (self.subtractionPercent/100)), 0.0)
+			tables['subtracted'] = np.clip((self.model[band]['slope'] * subtracted) + self.model[band]['intercept'], 0.0, 1.0).astype('float32').ravel()
+		self.lookupTables = tables
+		return tables
+
+	def getModelParameters(self):
+		#Everything that determines the calibrated values, the ROIs only matter through the fitted model
+		parameters = {'GAMMA': self.gamma, 'SUBTRACTION': [self.subtractionPercent, self.subtractionSourceBand, self.subtractionFromBand], 'PIXEL_RANGE': [self.minPixelValue, self.maxPixelValue], 'MODEL': None}
+		if self.model != None:
+			parameters['MODEL'] = [{'slope': float(band['slope']), 'intercept': float(band['intercept']), 'r-value': float(band['r-value'])} for band in self.model]
+		return parameters
+
+	def getModelHash(self, theParameters=None):
+		#Hash of getModelParameters(), or of theParameters in the same form
+		parameters = theParameters if theParameters != None else self.getModelParameters()
+		return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+	def linearRegression(self, theX, theY):
+		#Least squares fit of each column of theY on the same column of theX, the slopes are NaN where all x are identical
+		dx = theX - theX.mean(axis=0)
+		dy = theY - theY.mean(axis=0)
+		sxx = (dx * dx).sum(axis=0)
+		syy = (dy * dy).sum(axis=0)
+		sxy = (dx * dy).sum(axis=0)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			slope = sxy / sxx
+			#Correlation of 0 when either variable is constant, as scipy's linregress reports it
+			rValue = np.where(sxx * syy > 0, sxy / np.sqrt(sxx * syy), 0.0)
+		intercept = theY.mean(axis=0) - (slope * theX.mean(axis=0))
+		return (slope, intercept, np.clip(rValue, -1.0, 1.0))
+
 	def loadCalibrationData(self):
 		#Reset defaults
 		self.rois = []
-		self.gamma = 2.2
+		self.gamma = 0.0 if self.linear else 2.2
 		self.subtractionPercent = 0
 		self.subtractionSourceBand = 3
 		self.subtractionFromBand = 1
 		#Read EXIF data
 		inExif = pyexiv2.metadata.ImageMetadata(self.fileName)
 		inExif.read()
+		self.dateTime = exifDateTime(inExif)
 		#Extract user comment field
 		exifField = inExif['Exif.Photo.UserComment'].value
 		if 'ROI' in exifField:
 			calibration = json.loads(exifField)
+			#A saved copy of RAW data is a TIFF, the flag keeps it treated as linear
+			self.linear = calibration.get('LINEAR', self.linear)
 			self.rois = calibration['ROI']
 			self.gamma = calibration['GAMMA']
 			self.subtractionPercent = calibration['SUBTRACTION'][0]
@@ -88,23 +298,56 @@ class RadiometricCalibrator():
 	def loadImage(self, theImage):
 		self.rois = []
 		try:
-			self.image = cv2.imread(theImage)
-			self.image = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
+			self.image = readImageData(theImage, theReduction=self.reduction)
 		except IOError:
 			self.image = None
 			return False
-		#Get max pixel value
-		maxValue = np.max(self.image)
-		if maxValue < 255:
-			self.maxValue = 255
-		else:
-			self.maxValue = 65,535
+		#White level from the bit depth of the image
+		self.minPixelValue = 0
+		self.maxPixelValue = pixelMaximum(self.image)
+		self.linear = isRaw(theImage)
 		self.fileName = theImage
 		self.loadCalibrationData()
 		return True
 
-	def preprocessPixels(self, theImage):
-		image = (1.0/(self.maxPixelValue - self.minPixelValue)) * (theImage - self.minPixelValue)
+	def loadModel(self, theFileName):
+		#Load a model file written by saveModel(), the calibration image is neither read nor regressed again
+		with open(theFileName, 'r') as file:
+			calibration = json.load(file)
+		if calibration.get('VERSION', 0) > self.MODEL_VERSION:
+			raise ValueError('Unsupported calibration model version %s' % calibration['VERSION'])
+		#Parsed and checked before anything is assigned, a file that fails leaves the calibrator as it was
+		dateTime = None
+		if calibration.get('DATETIME') != None:
+			dateTime = datetime.datetime.strptime(calibration['DATETIME'], '%Y-%m-%dT%H:%M:%S')
+		model = None
+		if calibration['MODEL'] != None:
+			model = []
+			for band in range(3):
+				entry = dict(calibration['MODEL'][band])
+				entry['data'] = {'x': calibration['DATA'][band]['x'], 'y': calibration['DATA'][band]['y']}
+				model.append(entry)
+		parameters = {'GAMMA': calibration['GAMMA'], 'SUBTRACTION': list(calibration['SUBTRACTION']), 'PIXEL_RANGE': list(calibration['PIXEL_RANGE']), 'MODEL': None}
+		if model != None:
+			parameters['MODEL'] = [{'slope': float(band['slope']), 'intercept': float(band['intercept']), 'r-value': float(band['r-value'])} for band in model]
+		if calibration.get('HASH', self.getModelHash(parameters)) != self.getModelHash(parameters):
+			raise ValueError('Calibration model %s does not match its hash' % theFileName)
+		self.fileName = calibration.get('SOURCE', '')
+		self.dateTime = dateTime
+		self.image = None
+		self.linear = calibration.get('LINEAR', False)
+		self.rois = calibration['ROI']
+		self.gamma = calibration['GAMMA']
+		self.subtractionPercent, self.subtractionSourceBand, self.subtractionFromBand = calibration['SUBTRACTION']
+		self.minPixelValue, self.maxPixelValue = calibration['PIXEL_RANGE']
+		self.model = model
+		return True
+
+	def preprocessPixels(self, theImage, out=None, maxValue=None):
+		if out is not None:
+			return self.preprocessPixelsInPlace(theImage, out, maxValue)
+		maxValue = self.maxPixelValue if maxValue == None else maxValue
+		image = (1.0/(maxValue - self.minPixelValue)) * (theImage - self.minPixelValue)
 		if self.gamma != 0.0:
 			image = np.power(image, 1.0/self.gamma)
 		if self.subtractionPercent != 0:
@@ -112,9 +355,41 @@ class RadiometricCalibrator():
 			image[ image < 0] = 0.0
 		return image
 
+	def preprocessPixelsInPlace(self, theImage, theOut, theMaxValue=None):
+		maxValue = self.maxPixelValue if theMaxValue == None else theMaxValue
+		np.copyto(theOut, theImage, casting='unsafe')
+		if self.minPixelValue != 0:
+			np.subtract(theOut, float(self.minPixelValue), out=theOut)
+		np.multiply(theOut, 1.0/(maxValue - self.minPixelValue), out=theOut)
+		if self.gamma != 0.0:
+			np.power(theOut, 1.0/self.gamma, out=theOut)
+		if self.subtractionPercent != 0:
+			#from - (source * percent) computed as ((from / percent) - source) * percent to avoid a temporary band
+			percent = self.subtractionPercent/100
+			fromBand = theOut[:,:,self.subtractionFromBand-1]
+			np.divide(fromBand, percent, out=fromBand)
+			np.subtract(fromBand, theOut[:,:,self.subtractionSourceBand-1], out=fromBand)
+			np.multiply(fromBand, percent, out=fromBand)
+			np.maximum(theOut, 0.0, out=theOut)
+		return theOut
+
+	def roiStatistics(self, theX, theY, theWidth, theHeight):
+		#Per band statistics of a rectangle of the loaded image, clipped to the image bounds
+		if self.image is None:
+			return None
+		#The rectangle is in full resolution pixels
+		left = max(0, int(round(theX / self.reduction)))
+		top = max(0, int(round(theY / self.reduction)))
+		right = min(self.image.shape[1], int(round((theX + theWidth) / self.reduction)))
+		bottom = min(self.image.shape[0], int(round((theY + theHeight) / self.reduction)))
+		if right <= left or bottom <= top:
+			return {'mean': [0.0, 0.0, 0.0], 'median': [0.0, 0.0, 0.0], 'std': [0.0, 0.0, 0.0], 'count': 0}
+		pixels = self.image[top:bottom, left:right].reshape(-1, self.image.shape[2])
+		return {'mean': np.mean(pixels, axis=0).tolist(), 'median': np.median(pixels, axis=0).tolist(), 'std': np.std(pixels, axis=0).tolist(), 'count': pixels.shape[0]}
+
 	def save(self):
 		#Make new calibration record to save in EXIF data
-		exifData = {'ROI': self.rois, 'GAMMA': self.gamma, 'SUBTRACTION': [self.subtractionPercent, self.subtractionSourceBand, self.subtractionFromBand]}
+		exifData = {'ROI': self.rois, 'GAMMA': self.gamma, 'SUBTRACTION': [self.subtractionPercent, self.subtractionSourceBand, self.subtractionFromBand], 'LINEAR': self.linear}
 		fileName = self.fileName
 		#Load original EXIF data
 		inExif = pyexiv2.metadata.ImageMetadata(fileName)
@@ -124,9 +399,15 @@ class RadiometricCalibrator():
 		if not '-calibration.' in fileName:
 			#Update filename since first time save
 			path, baseName = os.path.split(self.fileName)
-			baseName = baseName.split('.')[0] + '-calibration.jpg'
+			#JPEG is 8 bit only, keep deeper images and linear RAW data lossless
+			extension = '.jpg' if self.image.dtype.name == 'uint8' and not self.linear else '.tif'
+			baseName = baseName.split('.')[0] + '-calibration' + extension
 			fileName = os.path.join(path, baseName)
-			cv2.imwrite(fileName, cv2.cvtColor(self.image, cv2.COLOR_RGB2BGR))
+			image = self.image
+			if self.reduction != 1:
+				#The copy is always written at full resolution
+				image = readImageData(self.fileName)
+			cv2.imwrite(fileName, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
 			#Transfer EXIF data to new file and reload
 			outExif = pyexiv2.metadata.ImageMetadata(fileName)
 			outExif.read()
@@ -137,6 +418,26 @@ class RadiometricCalibrator():
 			#Save EXIF data and generate model
 			inExif.write()
 			self.generateModel()
+		#Model file next to the calibration image for batch jobs
+		self.saveModel(os.path.splitext(self.fileName)[0] + '.json')
+
+	def saveModel(self, theFileName):
+		#Compact, versioned model file that batch jobs can load without the calibration image
+		calibration = self.getModelParameters()
+		calibration['VERSION'] = self.MODEL_VERSION
+		calibration['HASH'] = self.getModelHash()
+		calibration['SOURCE'] = self.fileName
+		calibration['DATETIME'] = None
+		if self.dateTime != None:
+			calibration['DATETIME'] = self.dateTime.strftime('%Y-%m-%dT%H:%M:%S')
+		calibration['ROI'] = self.rois
+		calibration['LINEAR'] = self.linear
+		calibration['DATA'] = None
+		if self.model != None:
+			calibration['DATA'] = [{'x': [float(x) for x in band['data']['x']], 'y': [float(y) for y in band['data']['y']]} for band in self.model]
+		with open(theFileName, 'w') as file:
+			json.dump(calibration, file, sort_keys=True)
+		return calibration['HASH']
 
 	def setGamma(self, theValue):
 		self.gamma = theValue